@@ -0,0 +1,110 @@
+"""
+Benchmark planetbot's contrast stretch: the old scipy curve_fit of the
+histogram plus ImageOps.autocontrast, against the NumPy closed-form fit and
+lookup table (twitter_planetbot._autocontrast), on full-size frames.
+
+The frames are synthetic grayscale 1920x1080 images: a noisy peak at
+different brightnesses and widths, some with a block of no-data black. Also
+reports how far apart the two stretches' outputs are (the old fit doesn't
+always converge), and what importing scipy.optimize cost the old way.
+
+Run from the repo root:
+    python -m benchmarks.bench_contrast [repeats]
+"""
+
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+
+import twitter_planetbot
+
+REPEATS = 5
+
+# (mean, standard deviation, fraction of the frame that's no-data black):
+FRAMES = [(60, 12, 0.0), (110, 25, 0.0), (150, 8, 0.3), (90, 40, 0.45), (200, 15, 0.1)]
+
+
+def _frame(mean: float, std: float, black: float, seed: int) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    height, width = twitter_planetbot.DEFAULT_HEIGHT, twitter_planetbot.DEFAULT_WIDTH
+    pixels = np.clip(rng.normal(mean, std, (height, width)), 0, 255).astype(np.uint8)
+    pixels[:, : int(black * width)] = 0
+    return Image.fromarray(pixels)
+
+
+def _gauss(x, *p):
+    # pylint: disable=invalid-name
+    A, mu, sigma = p
+    return A * np.exp(-((x - mu) ** 2) / (2.0 * sigma**2))
+
+
+def _old_ignore(hist, offset=10, width=3.0):
+    """planetbot's old _ignore: a scipy curve_fit of a Gaussian to the histogram"""
+    from scipy import optimize  # pylint: disable=import-outside-toplevel
+
+    p_max = max(hist[offset:])
+    params_initial = [p_max, hist.index(p_max), 20.0]
+    xdata = list(range(len(hist)))
+    coeff, _ = optimize.curve_fit(_gauss, xdata, hist, params_initial)
+
+    data_start = int(coeff[1] - width * coeff[2])
+    data_end = int(coeff[1] + width * coeff[2])
+    if data_start < 0 or data_start > 255:
+        data_start = 0
+    if data_end < 0 or data_end > 255:
+        data_end = 255
+    if data_end <= data_start:
+        data_start = 0
+        data_end = 255
+    return list(range(0, data_start)) + list(range(data_end, 255))
+
+
+def _old_autocontrast(image: Image.Image) -> Image.Image:
+    """The old stretch, including its second histogram pass"""
+    hist = image.histogram()
+    return ImageOps.autocontrast(image, ignore=_old_ignore(hist))
+
+
+def _best(func, image: Image.Image) -> float:
+    """Best-of-REPEATS seconds for func(image)"""
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func(image)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    """Time old and new contrast stretches on each frame"""
+    global REPEATS  # pylint: disable=global-statement
+    if len(sys.argv) > 1:
+        REPEATS = int(sys.argv[1])
+
+    start = time.perf_counter()
+    from scipy import optimize  # pylint: disable=import-outside-toplevel,unused-import
+
+    print(f"scipy.optimize import: {1000 * (time.perf_counter() - start):.1f} ms (old only)")
+    print(f"{'frame':>18} {'old ms':>8} {'new ms':>8} {'speedup':>8} {'max diff':>9} {'% differ':>9}")
+    for seed, (mean, std, black) in enumerate(FRAMES):
+        image = _frame(mean, std, black, seed)
+        name = f"{mean}+/-{std} {black:.0%} black"
+        new_image = twitter_planetbot._autocontrast(image)  # pylint: disable=protected-access
+        new = _best(twitter_planetbot._autocontrast, image)  # pylint: disable=protected-access
+        try:
+            old_image = _old_autocontrast(image)
+        except RuntimeError as err:  # curve_fit didn't converge
+            print(f"{name:>18} {'failed':>8} {1000 * new:>8.2f}   ({err})")
+            continue
+        old = _best(_old_autocontrast, image)
+        diff = np.abs(np.asarray(old_image, dtype=int) - np.asarray(new_image, dtype=int))
+        print(
+            f"{name:>18} {1000 * old:>8.2f} {1000 * new:>8.2f} {old / new:>7.1f}x "
+            f"{diff.max():>9} {100 * np.count_nonzero(diff) / diff.size:>8.1f}%"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Benchmark publishing end to end against the local stand-in (see
+tweetbot_lib/standin.py): every daily bot's main(), from its run_recently
+check through fetching its text or image (readtheplaque, timeg.host, the
+USGS map server) to its posts going out.
+
+Each run gets a fresh state database, so run_recently lets it through and
+the outbox has nothing already sent. Reports each bot's p50/p99/mean
+latency, the requests it made to the stand-in per run, any posts left
+unsent in the outbox and how many runs failed (raised out of main()). The
+streaming bots (replybot, sfyimby, stream_search) aren't run: they never
+return.
+
+With --prerender, bots that can render posts ahead (planetbot) get one
+queued before each run, outside the timing, so the run only pops and
+publishes it.
+
+Run from the repo root:
+    python -m benchmarks.bench_publish [--runs 20] [--latency 0.05]
+        [--error_rate 0.1] [--rate_limit 30/60] [--only planetbot] [--prerender]
+"""
+
+import argparse
+import importlib
+import os
+import statistics
+import tempfile
+import time
+
+import tweetbot_lib
+from tweetbot_lib import (
+    backends,
+    clients,
+    credentials,
+    outbox,
+    ratelimit,
+    scheduler,
+    standin,
+    state,
+    tracing,
+)
+
+RUNS = 20
+
+
+def _write_credentials(tmpdir: str, botnames: list[str]) -> None:
+    """Stand-in credentials for every bot, and point credentials.py at them"""
+    files = {
+        "KEYFILE": "".join(
+            f"{b}{k}=standin\n" for b in botnames
+            for k in ("APP_KEY", "APP_SEC", "OAUTH_TOKEN", "OAUTH_TOKEN_SEC")
+        ),
+        "TOKENFILE": "".join(f"{b} standin\n" for b in botnames),
+        "BLUESKYFILE": "".join(f"{b} {b}.bsky.social standin\n" for b in botnames),
+    }
+    for constant, text in files.items():
+        path = os.path.join(tmpdir, constant.lower())
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write(text)
+        setattr(credentials, constant, path)
+    credentials.clear()
+
+
+def _point_at(server: standin.StandinServer) -> None:
+    """Send the backends and the bots' own fetches to the stand-in"""
+    os.environ[backends.STANDIN_URL_ENV] = server.url
+    plaque = importlib.import_module("twitter_readtheplaque")
+    plaque.URLS = {k: f"{server.url}/{v}" for k, v in plaque.SUFFIXES.items()}
+    importlib.import_module("twitter_timeghost").tweet_url = f"{server.url}/tweet"
+    importlib.import_module("twitter_planetbot").USGS_MAPSERV_URL = f"{server.url}/cgi-bin/mapserv"
+
+
+def _run(
+    job: scheduler.Job, tmpdir: str, run: int, prerender: bool = False
+) -> tuple[float, int]:
+    """
+    Run a job once with a fresh state database: (seconds, posts left unsent),
+    or None if the run raised
+    """
+    state.STATE_DB = os.path.join(tmpdir, f"{job.name}-{run}.sqlite3")
+    module = importlib.import_module(job.module)
+    try:
+        if prerender and hasattr(module, "prerender"):
+            module.prerender(1, list(job.args))
+        start = time.perf_counter()
+        with tracing.run(job.state_botname), tweetbot_lib.bot_context(job.script):
+            module.main(*job.args)
+        seconds = time.perf_counter() - start
+    except Exception as err:  # pylint: disable=broad-except
+        print(f"{job.name} run {run} failed: {err!r}")
+        return None
+    return seconds, len(outbox.pending())
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    """The pct'th percentile, nearest rank"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+def get_args():
+    """Parse the cli args"""
+    parser = argparse.ArgumentParser(description="Time the bots' publishing against a stand-in")
+    parser.add_argument("--runs", type=int, default=RUNS, help="runs per bot")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds the stand-in delays each request"
+    )
+    parser.add_argument(
+        "--error_rate", type=float, default=0.0, help="fraction of requests that get a 503"
+    )
+    parser.add_argument(
+        "--rate_limit",
+        type=standin.parse_rate_limit,
+        default=None,
+        metavar="N/SECONDS",
+        help="stand-in rate limit: N requests per path per SECONDS",
+    )
+    parser.add_argument("--only", help="only run jobs whose name or module contains this")
+    parser.add_argument(
+        "--prerender", action="store_true", help="queue a prerendered post before each run"
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Run every daily bot against the stand-in and print latency and requests per run"""
+    args = get_args()
+    jobs = [
+        job for job in scheduler.JOBS
+        if args.only is None or args.only in job.name or args.only in job.module
+    ]
+    server = standin.serve(
+        latency=args.latency, error_rate=args.error_rate, rate_limit=args.rate_limit
+    )
+    saved_state_db, saved_trace_dir = state.STATE_DB, tracing.TRACE_DIR
+    with tempfile.TemporaryDirectory() as tmpdir:
+        try:
+            tracing.TRACE_DIR = tmpdir
+            _write_credentials(tmpdir, sorted({j.script for j in jobs} | {j.state_botname for j in jobs}))
+            _point_at(server)
+            # A cold map cache, so planet runs fetch from the stand-in:
+            importlib.import_module("twitter_planetbot").WMS_CACHE_DIR = os.path.join(tmpdir, "wms")
+            rows = []
+            for job in jobs:
+                clients.clear()
+                ratelimit.clear()
+                before = sum(server.requests.values())
+                times, unsent, failed = [], 0, 0
+                for run in range(args.runs):
+                    outcome = _run(job, tmpdir, run, args.prerender)
+                    if outcome is None:
+                        failed += 1
+                        continue
+                    times.append(1000 * outcome[0])
+                    unsent += outcome[1]
+                requests = (sum(server.requests.values()) - before) / args.runs
+                rows.append((job.name, times, requests, unsent, failed))
+
+            print(
+                f"{'bot':18} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9} {'req/run':>8} "
+                f"{'unsent':>7} {'failed':>7}"
+            )
+            for name, times, requests, unsent, failed in rows:
+                if times:
+                    timing = (
+                        f"{_percentile(times, 50):>9.1f} {_percentile(times, 99):>9.1f} "
+                        f"{statistics.mean(times):>9.1f}"
+                    )
+                else:
+                    timing = f"{'-':>9} {'-':>9} {'-':>9}"
+                print(f"{name:18} {timing} {requests:>8.1f} {unsent:>7} {failed:>7}")
+        finally:
+            state.STATE_DB, tracing.TRACE_DIR = saved_state_db, saved_trace_dir
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
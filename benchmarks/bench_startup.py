@@ -0,0 +1,107 @@
+"""
+Benchmark bot startup: time from process start to the run_recently decision.
+
+Each twitter_*.py entry point runs in a fresh interpreter against a scratch
+state database in which every bot has just run, so main() returns as soon as
+run_recently decides. That's the cost of every no-op cron or scheduler
+recheck. The streaming bots never call run_recently; for them only the
+import is timed. The bots read stand-in credentials from scratch files (see
+bench_publish), so no real secrets files are needed.
+
+Run from the repo root:
+    python -m benchmarks.bench_startup [repeats]
+"""
+
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import bench_publish
+from tweetbot_lib import credentials, scheduler, state
+
+REPEATS = 5
+
+# Bots whose main() never reaches run_recently (they stream forever):
+STREAMING = {"twitter_replybot", "twitter_sfyimby", "twitter_stream_search"}
+
+_CHILD = """
+import time
+start = time.perf_counter()
+import importlib, json, sys
+import tweetbot_lib
+with tweetbot_lib.bot_context(sys.argv[3]):
+    module = importlib.import_module(sys.argv[1])
+    imported = time.perf_counter()
+    if sys.argv[1] not in sys.argv[2].split(","):
+        module.main(*sys.argv[4:])
+decided = time.perf_counter()
+print(json.dumps([imported - start, decided - imported]))
+"""
+
+
+def _time_bot(module: str, botname: str, args: tuple, env: dict) -> tuple:
+    """Best-of-REPEATS (process, import, import-to-decision) seconds, or an error"""
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-c", _CHILD, module, ",".join(STREAMING), botname, *args],
+            capture_output=True,
+            text=True,
+            env=env,
+            check=False,
+        )
+        process = time.perf_counter() - start
+        if proc.returncode != 0:
+            return proc.stderr.strip().splitlines()[-1]
+        imported, decided = json.loads(proc.stdout.strip().splitlines()[-1])
+        times = (process, imported, decided)
+        best = times if best is None else tuple(map(min, best, times))
+    return best
+
+
+def main():
+    """Time every bot entry point's startup"""
+    global REPEATS  # pylint: disable=global-statement
+    if len(sys.argv) > 1:
+        REPEATS = int(sys.argv[1])
+
+    jobs = {job.module: job for job in scheduler.JOBS}
+    modules = sorted(os.path.basename(f)[:-3] for f in glob.glob("twitter_*.py"))
+    scripts = {m: jobs[m].script if m in jobs else f"{m}.py" for m in modules}
+
+    saved = credentials.KEYFILE, credentials.TOKENFILE, credentials.BLUESKYFILE
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bench_publish._write_credentials(  # pylint: disable=protected-access
+            tmpdir, sorted(set(scripts.values()) | {j.state_botname for j in scheduler.JOBS})
+        )
+        env = dict(
+            os.environ,
+            TWEETBOT_STATE_DB=os.path.join(tmpdir, "state.sqlite3"),
+            TWEETBOT_TRACE_DIR=tmpdir,
+            TWEETBOT_KEYFILE=credentials.KEYFILE,
+            TWEETBOT_TOKENFILE=credentials.TOKENFILE,
+            TWEETBOT_BLUESKYFILE=credentials.BLUESKYFILE,
+        )
+        credentials.KEYFILE, credentials.TOKENFILE, credentials.BLUESKYFILE = saved
+        for job in scheduler.JOBS:
+            state.claim(job.state_botname, path=env["TWEETBOT_STATE_DB"])
+
+        print(f"{'bot':28} {'process ms':>11} {'import ms':>10} {'decide ms':>10}")
+        for module in modules:
+            args = jobs[module].args if module in jobs else ()
+            result = _time_bot(module, scripts[module], args, env)
+            if isinstance(result, str):
+                print(f"{module:28} failed: {result}")
+                continue
+            process, imported, decided = (1000 * t for t in result)
+            decide = "-" if module in STREAMING else f"{decided:.1f}"
+            print(f"{module:28} {process:>11.1f} {imported:>10.1f} {decide:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Benchmark tweetify_text word packing against corpus size.
+
+Builds corpora by repeating txt/guthrie_lyrics.txt 1x, 2x, 4x, ... and times
+tweetify_text on each. If packing is linear, the time per word stays flat as
+the corpus grows.
+
+Run from the repo root:
+    python -m benchmarks.bench_tweetify [max_doublings]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from tweetbot_lib import get_tweet_filename, tweetify_text
+
+REPEATS = 3
+
+
+def _time_tweetify(textfile: str) -> float:
+    """Best-of-REPEATS wall time for tweetify_text on textfile"""
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        tweetify_text(textfile)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    """Time packing for corpora of doubling size and print time per word"""
+    max_doublings = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    with open(get_tweet_filename("guthrie_lyrics.txt"), encoding="utf-8") as fh:
+        base = fh.read()
+    base_words = len(base.split())
+
+    print(f"{'copies':>8} {'words':>10} {'seconds':>10} {'us/word':>10}")
+    for doubling in range(max_doublings + 1):
+        copies = 2**doubling
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=".txt", encoding="utf-8", delete=False
+        ) as corpus:
+            corpus.write(base * copies)
+        try:
+            seconds = _time_tweetify(corpus.name)
+        finally:
+            os.remove(corpus.name)
+
+        words = base_words * copies
+        print(f"{copies:>8} {words:>10} {seconds:>10.4f} {1e6 * seconds / words:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Fixtures for the tests: a scratch state store, trace directory and
+credential files for every test, and a local stand-in server (see
+tweetbot_lib/standin.py) for the tests that publish.
+"""
+
+import os
+
+import pytest
+
+from tweetbot_lib import backends, clients, credentials, ratelimit, standin, state, tracing
+
+BOTNAME = "twitter_testbot.py"
+
+
+@pytest.fixture(autouse=True)
+def scratch(tmp_path, monkeypatch):
+    """Point the state store, traces and credentials at tmp_path, with empty caches"""
+    monkeypatch.setattr(state, "STATE_DB", str(tmp_path / "state.sqlite3"))
+    monkeypatch.setattr(state, "LEGACY_MONITOR_FILE", str(tmp_path / "monitor_{botname}.txt"))
+    monkeypatch.setattr(tracing, "TRACE_DIR", str(tmp_path / "traces"))
+    files = {
+        "KEYFILE": "".join(
+            f"{BOTNAME}{k}=standin\n" for k in credentials.TWITTER_KEYNAMES
+        ),
+        "TOKENFILE": f"{BOTNAME} standin\n",
+        "BLUESKYFILE": f"{BOTNAME} testbot.bsky.social standin\n",
+    }
+    for constant, text in files.items():
+        path = tmp_path / constant.lower()
+        path.write_text(text, encoding="utf-8")
+        monkeypatch.setattr(credentials, constant, str(path))
+    # Retry right away, rather than after a random backoff:
+    monkeypatch.setattr(ratelimit, "backoff", lambda *args, **kwargs: 0.0)
+    clients.clear()
+    ratelimit.clear()
+    credentials.clear()
+    yield tmp_path
+    clients.clear()
+    ratelimit.clear()
+    credentials.clear()
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """A stand-in server that every backend talks to"""
+    server = standin.serve()
+    monkeypatch.setenv(backends.STANDIN_URL_ENV, server.url)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def posts_to(server, platform: str) -> list[dict]:
+    """The posts the stand-in received for 'platform'"""
+    return [post for post in server.posts if post["platform"] == platform]
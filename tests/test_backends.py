@@ -0,0 +1,101 @@
+"""Publishing through the backends against the stand-in"""
+
+import time
+
+from mastodon.errors import MastodonServerError
+import pytest
+
+from conftest import BOTNAME, posts_to
+import tweetbot_lib
+from tweetbot_lib import backends
+
+PLATFORMS = ["bluesky", "mastodon", "twitter"]
+
+
+def _fail_first(server, method: str, path: str, status: int, times: int = 1) -> None:
+    """Make the stand-in answer the first 'times' requests to 'path' with 'status'"""
+    route = server.routes[(method, path)]
+    failures = iter(range(times))
+
+    def _flaky(srv, fields, body):
+        if next(failures, None) is not None:
+            return status, {"error": "stand-in failure"}
+        return route(srv, fields, body)
+
+    server.routes[(method, path)] = _flaky
+
+
+def test_publish_fans_out_one_post_per_platform(server):
+    # Build the clients (and import the platform libraries) outside the timing:
+    for platform in ("twitter", "mastodon"):
+        _ = backends.BACKENDS[platform](BOTNAME).client
+    server.latency = 0.3
+
+    tweet = tweetbot_lib.BotTweet("hello from the tests", botname=BOTNAME)
+    start = time.perf_counter()
+    results = tweet.publish(do_mastodon=True, do_twitter=True, do_bluesky=True)
+    seconds = time.perf_counter() - start
+
+    assert sorted(results) == PLATFORMS
+    assert all(result.ok for result in results.values())
+    assert sorted(post["platform"] for post in server.posts) == PLATFORMS
+    assert {post["text"] for post in server.posts} == {"hello from the tests"}
+    # Four requests (Bluesky logs in first) take 1.2 s one after another, but
+    # only Bluesky's two in a row at once:
+    assert seconds < 1.0
+
+
+@pytest.mark.parametrize("status", [503, 429])
+@pytest.mark.parametrize(
+    "platform, method, path",
+    [
+        ("twitter", "POST", "/1.1/statuses/update.json"),
+        ("mastodon", "POST", "/api/v1/statuses"),
+        ("bluesky", "POST", "/xrpc/com.atproto.repo.createRecord"),
+    ],
+)
+def test_server_errors_and_rate_limits_are_retried(server, platform, method, path, status):
+    _fail_first(server, method, path, status, times=2)
+
+    backends.BACKENDS[platform](BOTNAME).post("through the errors")
+
+    assert server.requests[(method, path)] == 3
+    assert [post["text"] for post in posts_to(server, platform)] == ["through the errors"]
+
+
+def test_rate_limit_headers_pace_calls(server):
+    server.rate_limit = (1, 1.0)  # one request per path per second
+    backend = backends.TwitterBackend(BOTNAME)
+
+    start = time.perf_counter()
+    backend.post("first")
+    backend.post("second")
+    seconds = time.perf_counter() - start
+
+    # The first response said none were left until the window's reset, so
+    # the second post waited for it instead of getting a 429:
+    assert [post["text"] for post in posts_to(server, "twitter")] == ["first", "second"]
+    assert server.requests[("POST", "/1.1/statuses/update.json")] == 2
+    assert seconds >= 0.5
+
+
+def test_retries_stop_after_the_last_attempt(server):
+    _fail_first(server, "POST", "/api/v1/statuses", 503, times=10)
+    backend = backends.MastodonBackend(BOTNAME, attempts=2)
+
+    with pytest.raises(MastodonServerError):
+        backend.post("never posted")
+
+    assert server.requests[("POST", "/api/v1/statuses")] == 2
+    assert not server.posts
+
+
+def test_failed_platform_is_reported_not_raised(server):
+    _fail_first(server, "POST", "/api/v1/statuses", 400, times=1)
+    tweet = tweetbot_lib.BotTweet("only on twitter", botname=BOTNAME)
+
+    results = tweet.publish(do_mastodon=True, do_twitter=True)
+
+    assert results["twitter"].ok
+    assert not results["mastodon"].ok
+    assert [post["platform"] for post in server.posts] == ["twitter"]
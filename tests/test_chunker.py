@@ -0,0 +1,61 @@
+"""Packing words into posts for each platform's length limit"""
+
+import random
+
+import pytest
+
+from tweetbot_lib import backends, chunk_index, chunker
+
+LIMITS = [backends.BACKENDS[name].limit for name in ("twitter", "mastodon", "bluesky")]
+
+
+def _random_lens(seed: int, count: int = 300, max_len: int = 60) -> list[int]:
+    rng = random.Random(seed)
+    return [rng.randint(1, max_len) for _ in range(count)]
+
+
+def _post_lens(lens: list[int], breaks: list[int]) -> list[int]:
+    ends = breaks[1:] + [len(lens)]
+    return [sum(lens[first:end]) + end - first - 1 for first, end in zip(breaks, ends)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_balanced_packing_uses_as_few_posts_as_greedy(seed):
+    lens = _random_lens(seed)
+    greedy = chunker.greedy_breaks(lens, 280)
+    balanced = chunker.balanced_breaks(lens, 280)
+
+    assert len(balanced) == len(greedy)
+    assert max(_post_lens(lens, balanced)) <= 280
+    # ...and leaves the posts closer to the same length:
+    assert sum((280 - n) ** 2 for n in _post_lens(lens, balanced)) <= sum(
+        (280 - n) ** 2 for n in _post_lens(lens, greedy)
+    )
+
+
+def test_weighted_truncation_fits_twitter():
+    twitter = LIMITS[0]
+    cut = twitter.truncate("漢" * 200)
+    assert twitter.text_len(cut) <= 280
+    assert len(cut) == 140
+
+
+def test_urls_are_never_cut():
+    url = "https://example.com/" + "a" * 400
+    for limit in LIMITS:
+        assert limit.truncate(url) == url
+        assert limit.truncate(f"see {url}") in ("see", f"see {url}")
+
+
+@pytest.mark.parametrize("balanced", [False, True])
+def test_every_indexed_chunk_fits_its_limit(tmp_path, balanced):
+    url = "https://example.com/" + "a" * 400
+    textfile = tmp_path / "text.txt"
+    textfile.write_text(
+        f"start {'漢' * 200} {url} middle {'x' * 600} " + "word " * 300, encoding="utf-8"
+    )
+    for limit in LIMITS:
+        index = chunk_index.ChunkIndex(str(textfile), limit=limit, balanced=balanced)
+        for i in range(len(index)):
+            text = index.tweet(i, botname="testbot").str
+            assert limit.text_len(text) <= limit.max_len or text == url
@@ -0,0 +1,63 @@
+"""The outbox against the stand-in: each queued post goes out once"""
+
+import time
+
+from conftest import BOTNAME, posts_to
+from tweetbot_lib import outbox, state
+
+
+def _expire_leases() -> None:
+    """Make every unsent row's lease run out, as if its drain had died"""
+    with state.connect() as conn:
+        conn.execute(
+            "UPDATE outbox SET next_try = ? WHERE sent IS NULL AND next_try IS NOT NULL",
+            (time.time() - 1,),
+        )
+
+
+def test_enqueueing_a_post_twice_sends_it_once(server):
+    ids = outbox.enqueue(BOTNAME, "only once", ["mastodon", "twitter"])
+    assert outbox.enqueue(BOTNAME, "only once", ["mastodon", "twitter"]) == ids
+
+    assert outbox.drain() == (2, 0)
+    assert outbox.enqueue(BOTNAME, "only once", ["mastodon", "twitter"]) == []
+    assert outbox.drain() == (0, 0)
+    assert sorted(post["platform"] for post in server.posts) == ["mastodon", "twitter"]
+
+
+def test_failed_post_is_retried_later(server):
+    server.error_rate = 1.0
+    ids = outbox.enqueue(BOTNAME, "eventually", ["bluesky"])
+    assert outbox.drain() == (0, 1)
+    assert outbox.unsent(ids)["bluesky"] > time.time()
+
+    server.error_rate = 0.0
+    _expire_leases()  # its backoff, rather
+    assert outbox.drain() == (1, 0)
+    assert [post["text"] for post in posts_to(server, "bluesky")] == ["eventually"]
+    assert outbox.unsent(ids) == {}
+
+
+def test_row_taken_over_after_its_lease_is_not_sent_twice(server):
+    outbox.enqueue(BOTNAME, "taken over", ["twitter"])
+    stale = outbox.claim()  # a drain that stalls before sending
+
+    _expire_leases()
+    assert outbox.drain() == (1, 0)  # another drain takes it over and sends it
+
+    # The stalled drain wakes up: its lease is gone, so it skips the row
+    assert outbox.deliver(stale) == {}
+    assert [post["text"] for post in posts_to(server, "twitter")] == ["taken over"]
+
+
+def test_resent_mastodon_row_is_not_posted_twice(server):
+    outbox.enqueue(BOTNAME, "sent, then crashed", ["mastodon"])
+    [entry] = outbox.claim()
+    # A drain that sends the post but dies before recording it:
+    outbox._send(entry)  # pylint: disable=protected-access
+
+    _expire_leases()
+    assert outbox.drain() == (1, 0)  # resent, under the same idempotency key
+
+    assert [post["text"] for post in posts_to(server, "mastodon")] == ["sent, then crashed"]
+    assert outbox.pending() == []
@@ -0,0 +1,32 @@
+"""planetbot's box sampler"""
+
+# pylint: disable=protected-access
+
+import numpy as np
+import pytest
+
+import twitter_planetbot
+
+
+def test_sampled_boxes_fit_on_the_map():
+    rng = np.random.default_rng(0)
+    lats, lngs = twitter_planetbot._sample_corners(10, 16 / 9, 10000, rng)
+
+    widths = 10 * 16 / 9 / np.cos(np.radians(lats))
+    assert np.all(lats + 10 <= 90)
+    assert np.all(lngs >= 0)
+    assert np.all(lngs + widths <= 360)
+
+
+def test_sampled_latitudes_follow_the_sphere():
+    rng = np.random.default_rng(1)
+    lats, _ = twitter_planetbot._sample_corners(1, 1, 100000, rng)
+
+    # Uniform on the sphere: sin(lat) is uniform, so half lie within 30 degrees
+    # of the equator:
+    assert abs(np.mean(np.abs(lats) < 30) - 0.5) < 0.01
+
+
+def test_boxes_wider_than_the_map_are_refused():
+    with pytest.raises(ValueError):
+        twitter_planetbot._sample_corners(10, 40, 1)
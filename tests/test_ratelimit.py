@@ -0,0 +1,66 @@
+"""The token buckets and retrying calls of the rate limiter"""
+
+import pytest
+
+from tweetbot_lib import ratelimit
+
+
+def _call(limiter, outcomes, **kwargs):
+    """ratelimit.call on a func that raises or returns each of 'outcomes' in turn"""
+    outcomes = iter(outcomes)
+    sleeps = []
+
+    def _func():
+        outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    result = ratelimit.call(
+        limiter,
+        _func,
+        lambda outcome: None,
+        lambda err: isinstance(err, ConnectionError),
+        sleep=sleeps.append,
+        **kwargs,
+    )
+    return result, sleeps
+
+
+def test_bucket_paces_calls_once_empty():
+    bucket = ratelimit.TokenBucket(2, 1.0)
+    assert bucket.try_acquire()
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert 0 < bucket.wait_time() <= 1.0
+
+
+def test_headers_with_none_remaining_block_until_reset():
+    bucket = ratelimit.TokenBucket(10, 1.0)
+    bucket.update(
+        {"X-RateLimit-Limit": "10", "X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "30"}
+    )
+    assert 29 < bucket.wait_time() <= 30
+
+
+def test_retry_after_blocks_the_bucket():
+    bucket = ratelimit.TokenBucket(10, 1.0)
+    bucket.update({"Retry-After": "5"})
+    assert 4 < bucket.wait_time() <= 5
+
+
+def test_retryable_errors_are_retried():
+    result, _ = _call(ratelimit.TokenBucket(10, 1.0), [ConnectionError(), "ok"])
+    assert result == "ok"
+
+
+def test_other_errors_are_raised_at_once():
+    with pytest.raises(ValueError):
+        _call(ratelimit.TokenBucket(10, 1.0), [ValueError(), "ok"])
+
+
+def test_long_waits_raise_rate_limit_exceeded():
+    bucket = ratelimit.TokenBucket(10, 1.0)
+    bucket.block(60)
+    with pytest.raises(ratelimit.RateLimitExceeded):
+        _call(bucket, ["ok"], max_wait=5)
@@ -0,0 +1,48 @@
+"""Run claims in the state store"""
+
+import datetime
+import os
+import threading
+import time
+
+from tweetbot_lib import state
+
+
+def test_only_one_overlapping_claim_wins():
+    claims = []
+    barrier = threading.Barrier(8)
+
+    def _claim():
+        barrier.wait()
+        claims.append(state.claim("racer"))
+
+    threads = [threading.Thread(target=_claim) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len([c for c in claims if c is not None]) == 1
+
+
+def test_claim_is_refused_until_the_window_passes():
+    assert state.claim("daily") is not None
+    assert state.claim("daily") is None
+    assert state.claim("daily", seconds=0) is not None
+
+
+def test_due_agrees_with_claim():
+    open(state.LEGACY_MONITOR_FILE.format(botname="legacy"), "w", encoding="utf-8").close()
+    with state.connect() as conn:
+        conn.execute(
+            "INSERT INTO scheduled (botname, platform, day, post_at) VALUES (?, ?, ?, ?)",
+            ("scheduled", "mastodon", datetime.date.today().isoformat(), time.time()),
+        )
+    state.claim("ran")
+
+    botnames = ["legacy", "scheduled", "ran", "fresh"]
+    assert state.due(botnames) == ["fresh"]
+    # An old monitor file stops counting once the window has passed:
+    old = time.time() - 2 * 86400
+    os.utime(state.LEGACY_MONITOR_FILE.format(botname="legacy"), (old, old))
+    assert state.due(botnames) == ["legacy", "fresh"]
@@ -1,18 +1,45 @@
-"""Module to post to social media for bots. TODO: include bluesky"""
+"""Module to post to social media (Twitter, Mastodon, Bluesky) for bots."""
 
+from __future__ import annotations
+
+import contextlib
+import contextvars
 import datetime
-import inspect
+import itertools
 import os
-from pathlib import Path
-
-from mastodon import Mastodon
-import requests
-from twython import Twython
-from twython.exceptions import TwythonAuthError
+import sys
+from typing import TYPE_CHECKING, Iterable, Iterator
+
+from tweetbot_lib import (
+    backends,
+    chunk_index,
+    clients,
+    credentials,
+    media,
+    outbox,
+    state,
+    tracing,
+)
+from tweetbot_lib.backends import MASTODON_API_BASE_URL
+
+if TYPE_CHECKING:
+    from mastodon import Mastodon
+    from twython import Twython
 
 MAX_TWEET_LEN = 140
 
-MASTODON_API_BASE_URL = "https://botsin.space/"
+# The bot being run, when several bots share one process (see scheduler.py):
+_current_botname = contextvars.ContextVar("botname", default=None)
+
+
+@contextlib.contextmanager
+def bot_context(botname: str):
+    """Make 'botname' the default botname for BotTweets within the block"""
+    token = _current_botname.set(botname)
+    try:
+        yield
+    finally:
+        _current_botname.reset(token)
 
 
 class BotTweet:
@@ -20,45 +47,68 @@ class BotTweet:
 
     @classmethod
     def _get_botname(cls):
-        frameinfo = inspect.stack()[-1]
-        botname = os.path.basename(frameinfo.filename)
-        return botname
+        botname = _current_botname.get()
+        if botname is not None:
+            return botname
+        # The outermost frame's file (the script being run). Walk the frames
+        # directly: inspect.stack() also reads source context for each one.
+        frame = sys._getframe()  # pylint: disable=protected-access
+        while frame.f_back is not None:
+            frame = frame.f_back
+        return os.path.basename(frame.f_code.co_filename)
 
     @classmethod
+    @tracing.span("run_recently")
     def run_recently(cls, seconds=86400, botname=None) -> bool:
+        """
+        Has this bot run in the last 'seconds' (or is today's post already
+        scheduled on a server)? If not, claim a run for it in the state
+        store. The check and the claim are one transaction, so two
+        overlapping runs can't both go ahead.
+        """
         if botname is None:
             botname = BotTweet._get_botname()
-        monitor_file = Path(f"/home/kester/.monitor_{botname}.txt")
-
-        if monitor_file.is_file():
-            last_modified = datetime.datetime.fromtimestamp(monitor_file.stat().st_mtime)
-            age = datetime.datetime.now() - last_modified
-            if age.total_seconds() > seconds:
-                # update file
-                with monitor_file.open("w") as fh:
-                    fh.write(str(datetime.datetime.now()))
-                return False
-            else:
-                return True
-        else:
-            # create file
-            with monitor_file.open("w") as fh:
-                fh.write(str(datetime.datetime.now()))
-            return False
+        if state.is_scheduled(botname, datetime.date.today().isoformat()):
+            return True
+        return state.claim(botname, seconds) is None
 
     # pylint: disable-next=E0601
-    def __init__(self, word: str = None, botname: str = None) -> None:
-        """Truncate word to MAX_TWEET_LEN if necessary"""
+    def __init__(
+        self, word: str = None, botname: str = None, max_len: int = None
+    ) -> None:
+        """
+        Truncate word to max_len if necessary. max_len defaults to the value
+        of MAX_TWEET_LEN when the tweet is made.
+        """
         self.botname = BotTweet._get_botname() if botname is None else botname
-        self.words = [] if word is None else [word[:MAX_TWEET_LEN]]
+        self.max_len = MAX_TWEET_LEN if max_len is None else max_len
+        self.words = [] if word is None else [word[: self.max_len]]
+
+    @property
+    def words(self) -> list[str]:
+        """
+        The words of the tweet. Change them with append/pop/set_text (or by
+        assigning a new list) so the running length stays correct.
+        """
+        return self._words
+
+    @words.setter
+    def words(self, words: list[str]) -> None:
+        """Set the words list and recompute the running length"""
+        self._words = list(words)
+        self._len = sum(len(w) for w in self._words) + max(len(self._words) - 1, 0)
 
     def pop(self) -> str:
         """Pop a word off of self.words"""
-        return self.words.pop()
+        word = self._words.pop()
+        self._len -= len(word) + (1 if self._words else 0)
+        return word
 
     def append(self, word: str) -> None:
         """Append 'word' to the self.words list, truncating if necessary"""
-        self.words.append(word[:MAX_TWEET_LEN])
+        word = word[: self.max_len]
+        self._len += len(word) + (1 if self._words else 0)
+        self._words.append(word)
 
     def can_take_new_word(self, word: str) -> bool:
         """Will tweet be under the length limit after adding a new word"""
@@ -68,21 +118,21 @@ class BotTweet:
         """Will tweet be too long after adding a new word"""
         assert isinstance(word, str)
         will_be_length = self.len + len(word)
-        return will_be_length > MAX_TWEET_LEN
+        return will_be_length > self.max_len
 
     def set_text(self, text: str) -> None:
         """Set the words array to input text"""
         self.words = [text]
 
     @property
-    def len(self) -> bool:
-        """Length of tweet text"""
-        return len(self.str)
+    def len(self) -> int:
+        """Length of tweet text, kept as a running count (no string join)"""
+        return self._len
 
     @property
     def is_too_long(self) -> bool:
-        """Does tweet length exceed MAX_TWEET_LEN"""
-        return self.len > MAX_TWEET_LEN
+        """Does tweet length exceed max_len"""
+        return self.len > self.max_len
 
     @property
     def str(self) -> str:
@@ -91,32 +141,22 @@ class BotTweet:
 
     @property
     def twitter_keys(self) -> dict:
-        """Property for the default twitter_keys_from_file file location"""
-        return self.twitter_keys_from_file()
+        """Keys for this twitter bot's authorization, from credentials.KEYFILE"""
+        return credentials.twitter_keys(self.botname)
 
     def twitter_keys_from_file(self, keyfile: str = "../keys.txt") -> dict:
         """
         Keys for this twitter bot's authorization. Assume the keys file is
-        at the location ../keys.txt unless specified otherwise.
+        at the location ../keys.txt unless specified otherwise. The file is
+        parsed once per process (and again only if it changes).
         """
-        auth_keys = {}
-
         keyfile_full = os.path.join(os.path.dirname(__file__), keyfile)
-        with open(keyfile_full, encoding="utf-8") as keys_fh:
-            for row in keys_fh.readlines():
-                name, value = row.strip().split("=")
-                auth_keys[name] = value
-
-        # Return only the keys for this bot:
-        keynames = ["APP_KEY", "APP_SEC", "OAUTH_TOKEN", "OAUTH_TOKEN_SEC"]
-        keys = [auth_keys[f"{self.botname}{n}"] for n in keynames]
-
-        return keys
+        return credentials.twitter_keys(self.botname, keyfile_full)
 
     @property
     def mastodon_access_token(self) -> str:
-        """Property for the default mastodon_access_token file location"""
-        return self.mastodon_access_token_from_file()
+        """Access token for this bot's mastodon authorization, from credentials.TOKENFILE"""
+        return credentials.mastodon_access_token(self.botname)
 
     def mastodon_access_token_from_file(
         self, file: str = "../mastodon_access_tokens.secret"
@@ -124,73 +164,94 @@ class BotTweet:
         """
         Access tokens for this bot's mastodon authorization. Assume the tokens
         file is at the location ../mastodon_access_tokens.secret unless
-        specified otherwise.
+        specified otherwise. The file is parsed once per process (and again
+        only if it changes).
         """
-        access_token = None
         tokenfile = os.path.join(os.path.dirname(__file__), file)
-        with open(tokenfile, encoding="utf-8") as tokens_fh:
-            for row in tokens_fh.readlines():
-                name, value = row.strip().split()
-                if name == self.botname:
-                    access_token = value
-        return access_token
+        return credentials.mastodon_access_token(self.botname, tokenfile)
+
+    def _get_twitter(self) -> Twython:
+        """This bot's cached Twython client"""
+        return backends.TwitterBackend(self.botname).client
 
     def _get_mastodon(self) -> Mastodon:
-        return Mastodon(
-            access_token=self.mastodon_access_token,
-            api_base_url=MASTODON_API_BASE_URL,
-        )
+        """This bot's cached Mastodon client"""
+        return backends.MastodonBackend(self.botname).client
+
+    @staticmethod
+    def _platforms(do_mastodon: bool, do_twitter: bool, do_bluesky: bool) -> list[str]:
+        """The enabled platforms' names"""
+        enabled = [
+            (do_twitter, backends.TwitterBackend),
+            (do_mastodon, backends.MastodonBackend),
+            (do_bluesky, backends.BlueskyBackend),
+        ]
+        return [backend.name for do, backend in enabled if do]
 
     def publish(
-        self, do_mastodon: bool = True, do_twitter: bool = False) -> None:
-        """Publish to twitter and mastodon"""
-        if do_twitter:
-            twitter = Twython(*self.twitter_keys)
-            try:
-                twitter.update_status(status=self.str)
-            except TwythonAuthError as err:
-                print(f"Twython Auth Error: {err}")
-
-        if do_mastodon:
-            try:
-                mastodon = self._get_mastodon()
-                mastodon.status_post(self.str)
-            except FileNotFoundError as err:
-                print(f"Can't find file: {err}")
+        self, do_mastodon: bool = True, do_twitter: bool = False, do_bluesky: bool = False
+    ) -> dict:
+        """
+        Publish to twitter, mastodon and bluesky (the enabled ones), all at
+        once. The post goes through the outbox, so a platform that fails is
+        retried later by the outbox worker rather than the post being lost.
+        Returns {backend name: PublishResult} for the platforms tried now.
+        """
+        return self._publish(self._platforms(do_mastodon, do_twitter, do_bluesky))
 
     def publish_with_image(
         self,
-        image_fn: str,
+        image_fn: str = None,
         do_mastodon: bool = True,
         do_twitter: bool = False,
-    ) -> None:
-        """Publish to twitter and mastodon with an image"""
-        with open(image_fn, "rb") as image:
-            if do_twitter:
-                try:
-                    twitter = Twython(*self.twitter_keys)
-                    response = twitter.upload_media(media=image)
-                    ids = [response["media_id"]]
-                    twitter.update_status(status=self.str, media_ids=ids)
-                except TwythonAuthError as err:
-                    print(f"Twython Auth Error: {err}")
-
-            if do_mastodon:
-                try:
-                    mastodon = self._get_mastodon()
-                    media_dict = mastodon.media_post(
-                        mime_type="image/jpeg", media_file=image_fn
-                    )
-                    mastodon.status_post(self.str, media_ids=media_dict)
-                except FileNotFoundError as err:
-                    print(f"Can't find file: {err}")
+        do_bluesky: bool = False,
+        image_data: bytes = None,
+    ) -> dict:
+        """
+        Publish to twitter, mastodon and bluesky (the enabled ones) with an
+        image (the JPEG file image_fn, or a JPEG's bytes image_data), all at
+        once, through the outbox like publish. Each platform's upload of the
+        image is cached (see media.py), so a retry or repost doesn't upload
+        it again. Returns {backend name: PublishResult}.
+        """
+        return self._publish(
+            self._platforms(do_mastodon, do_twitter, do_bluesky), image_fn, image_data
+        )
+
+    def _publish(
+        self, platforms: list[str], image_fn: str = None, image_data: bytes = None
+    ) -> dict:
+        """Queue the post for 'platforms' and send it right away"""
+        return publish_posts({platform: self for platform in platforms}, image_fn, image_data)
+
+    def enqueue(
+        self,
+        platforms: list[str] = None,
+        image_fn: str = None,
+        key: str = None,
+        image_data: bytes = None,
+    ) -> list[int]:
+        """
+        Queue the post (with image_fn or image_data, if given) for the outbox
+        worker to send to 'platforms' (default: mastodon), and return at
+        once. The same post is only sent once per day, or once per dedupe
+        'key' if given. Returns the outbox ids still to be sent.
+        """
+        if platforms is None:
+            platforms = self._platforms(True, False, False)
+        image = image_fn or image_data
+        digest = media.image_hash(image) if image else None
+        return outbox.enqueue(
+            self.botname, self.str, platforms, image_fn, digest, key, image_data=image_data
+        )
 
+    @tracing.span("fetch_text")
     def download_tweet_text(self, tweet_api_url: str) -> None:
         """
         Get a tweet's text from an API, which should return a JSON object
         with a 'tweet' key
         """
-        resp = requests.get(tweet_api_url, timeout=60)
+        resp = clients.get_session("http").get(tweet_api_url, timeout=60)
         text = resp.json()["tweet"]
         self.words = [text]
 
@@ -198,15 +259,99 @@ class BotTweet:
         return self.str
 
 
+@tracing.span("publish")
+def publish_posts(
+    posts: dict[str, BotTweet], image_fn: str = None, image_data: bytes = None
+) -> dict:
+    """
+    Publish one bot's post with its own text per platform ({platform name:
+    BotTweet}, e.g. from parse_text_and_get_today_posts), all at once and
+    through the outbox like BotTweet.publish. Returns {backend name:
+    PublishResult}.
+    """
+    if not posts:
+        return {}
+    botname = next(iter(posts.values())).botname
+    image = image_fn or image_data
+    digest = media.image_hash(image) if image else None
+
+    platforms_by_text = {}
+    for platform, tweet in posts.items():
+        platforms_by_text.setdefault(tweet.str, []).append(platform)
+    ids = []
+    for text, platforms in platforms_by_text.items():
+        ids += outbox.enqueue(botname, text, platforms, image_fn, digest, image_data=image_data)
+
+    results = {r.backend: r for r in outbox.send_now(ids).values()}
+    _record_outcome(botname, results, outbox.unsent(ids))
+    return results
+
+
+def _record_outcome(botname: str, results: dict, unsent: dict) -> None:
+    """
+    Record how the bot's claimed run went in the state store: published
+    only if every platform's post has gone out ('unsent': {platform:
+    next_try} of the ones that haven't, see outbox.unsent)
+    """
+    failed = [f"{r.backend}: {r.error!r}" for r in results.values() if not r.ok]
+    detail = failed + ["queued for retry"] if failed else []
+    # Posts that weren't even tried now (backing off, or given up on):
+    waiting = sorted(p for p, next_try in unsent.items() if p not in results and next_try)
+    gave_up = sorted(p for p, next_try in unsent.items() if p not in results and not next_try)
+    if waiting:
+        detail.append(f"{', '.join(waiting)} waiting to retry")
+    if gave_up:
+        detail.append(f"gave up on {', '.join(gave_up)}")
+
+    if failed or gave_up:
+        outcome = state.FAILED
+    elif unsent:
+        outcome = state.QUEUED
+    else:
+        outcome = state.PUBLISHED
+    state.finish_latest(botname, outcome, "; ".join(detail) or None)
+
+
 def get_tweet_filename(filename: str) -> str:
     """Assume the text file is in ../txt/"""
     return os.path.join(os.path.dirname(__file__), f"../txt/{filename}")
 
 
-def tweetify_text(textfile, use_lines: bool = False) -> list[BotTweet]:
+def pack_words(
+    words: Iterable[str], botname: str = None, max_len: int = None
+) -> Iterator[BotTweet]:
+    """
+    Pack 'words' into max_len-char-or-less BotTweet objects (MAX_TWEET_LEN by
+    default), yielding each one as it fills up.
+
+    Each BotTweet keeps a running character count, so the check for whether a
+    word still fits is O(1) and packing is linear in the number of words.
     """
-    Break the input string 'text' into MAX_TWEET_LEN-char-or-less BotTweet
-    objects.
+    if botname is None:
+        botname = BotTweet._get_botname()
+
+    # Fill each tweet until it can't append another word witout getting too
+    # long. Then yield that tweet and start a new tweet with the current word.
+    #
+    tweet = BotTweet(botname=botname, max_len=max_len)
+    for word in words:
+        if tweet.can_take_new_word(word):
+            tweet.append(word)
+        else:
+            yield tweet
+            tweet = BotTweet(word, botname=botname, max_len=max_len)
+
+    # Yield the final tweet:
+    #
+    yield tweet
+
+
+def tweetify_text(
+    textfile, use_lines: bool = False, max_len: int = None
+) -> list[BotTweet]:
+    """
+    Break the input string 'text' into max_len-char-or-less BotTweet
+    objects (MAX_TWEET_LEN by default).
 
     If use_lines is True, make one tweet per line in the file.
     """
@@ -216,7 +361,10 @@ def tweetify_text(textfile, use_lines: bool = False) -> list[BotTweet]:
         One file line per tweet, truncated to MAX_TWEET_LEN if necessary.
         Returns a list of BotTweet objects.
         """
-        tweets = [BotTweet(l) for l in file_.readlines()]
+        botname = BotTweet._get_botname()
+        tweets = [
+            BotTweet(l, botname=botname, max_len=max_len) for l in file_.readlines()
+        ]
         return tweets
 
     def _tweets_by_word(file_) -> list[str]:
@@ -225,55 +373,127 @@ def tweetify_text(textfile, use_lines: bool = False) -> list[BotTweet]:
         characters in length.
         Returns a list of BotTweet objects.
         """
-
-        # Fill each tweet until it can't append another word witout getting too
-        # long. Then put that tweet into the output list and start a new tweet
-        # with the current word.
-        #
-        tweets = []
-        tweet = BotTweet()
-        for word in file_.read().split():
-            if tweet.can_take_new_word(word):
-                tweet.append(word)
-            else:
-                tweets.append(tweet)
-                tweet = BotTweet(word)
-
-        # Append the file's final tweet:
-        #
-        tweets.append(tweet)
-        return tweets
+        return list(pack_words(file_.read().split(), max_len=max_len))
 
     with open(textfile, encoding="utf-8") as file_:
         tweets = _tweets_by_line(file_) if use_lines else _tweets_by_word(file_)
     return tweets
 
 
-def get_today_index(num_tweets: int, start_date: datetime.datetime) -> int:
+def iter_tweetify_text(
+    textfile, use_lines: bool = False, max_len: int = None
+) -> Iterator[BotTweet]:
+    """
+    Generator version of tweetify_text: read 'textfile' through mmap and yield
+    the same BotTweet objects one at a time, without holding the whole file's
+    text or tweet list in memory.
     """
-    Get today's index into a list that is num_tweets long, starting at 'start_date'
+    botname = BotTweet._get_botname()
+    with chunk_index.mapped(textfile) as data:
+        if use_lines:
+            tweets = (
+                BotTweet(line, botname=botname, max_len=max_len)
+                for line in chunk_index.iter_lines(data)
+            )
+        else:
+            tweets = pack_words(
+                chunk_index.iter_words(data), botname=botname, max_len=max_len
+            )
+
+        # Close the generators (releasing their views of the mmap) before the
+        # mmap is closed, even if the caller stops early:
+        try:
+            yield from tweets
+        finally:
+            tweets.close()
+
+
+def count_tweets(textfile, use_lines: bool = False, max_len: int = None) -> int:
     """
-    now = datetime.datetime.now()
+    Count the BotTweets tweetify_text would make from 'textfile', without
+    materializing them.
+    """
+    with chunk_index.mapped(textfile) as data:
+        return sum(1 for _ in chunk_index.chunk_spans(data, use_lines, max_len))
+
+
+def get_today_index(
+    num_tweets: int, start_date: datetime.datetime, now: datetime.datetime = None
+) -> int:
+    """
+    Get today's index into a list that is num_tweets long, starting at 'start_date'.
+    Pass 'now' to get the index for another day.
+    """
+    if now is None:
+        now = datetime.datetime.now()
     td_since_start = now - start_date
     today_index = td_since_start.days % num_tweets
     return today_index
 
 
-def get_today_tweet(tweets: list[str], start_date: datetime.datetime) -> str:
+def get_today_tweet(
+    tweets: Iterable[BotTweet], start_date: datetime.datetime, num_tweets: int = None
+) -> BotTweet:
     """
-    Get today's tweet text for the list 'tweets' starting at 'start_date'
+    Get today's tweet text for 'tweets' starting at 'start_date'. 'tweets' can
+    be a generator if num_tweets is given; it is consumed only up to today's
+    tweet.
     """
-    today_index = get_today_index(len(tweets), start_date)
-    today_tweet = tweets[today_index]
+    if num_tweets is None:
+        num_tweets = len(tweets)
+    today_index = get_today_index(num_tweets, start_date)
+    today_tweet = next(itertools.islice(tweets, today_index, None))
     return today_tweet
 
 
+@tracing.span("chunk")
 def parse_text_and_get_today_tweet(
-    textfile: str, start_date: datetime.datetime, use_lines: bool = False
-) -> str:
+    textfile: str,
+    start_date: datetime.datetime,
+    use_lines: bool = False,
+    use_index: bool = True,
+    max_len: int = None,
+) -> BotTweet:
     """
-    Get today's tweet text from a file, starting at 'start_date'
+    Get today's tweet text from a file, starting at 'start_date'. Uses the
+    file's chunk index to seek straight to today's chunk, or if use_index is
+    False, streams the file and stops at today's chunk.
     """
     tweetfile = get_tweet_filename(textfile)
-    tweets = tweetify_text(tweetfile, use_lines)
-    return get_today_tweet(tweets, start_date)
+    if not use_index:
+        num_tweets = count_tweets(tweetfile, use_lines, max_len)
+        tweets = iter_tweetify_text(tweetfile, use_lines, max_len)
+        return get_today_tweet(tweets, start_date, num_tweets)
+
+    index = chunk_index.ChunkIndex(tweetfile, use_lines, max_len)
+    today_index = get_today_index(len(index), start_date)
+    return index.tweet(today_index)
+
+
+@tracing.span("chunk")
+def parse_text_and_get_today_posts(
+    textfile: str,
+    start_date: datetime.datetime,
+    platforms: Iterable[str] = ("mastodon",),
+    use_lines: bool = False,
+    balanced: bool = False,
+    botname: str = None,
+) -> dict[str, BotTweet]:
+    """
+    Get today's post from a file for each platform, chunked to that
+    platform's own length limit (see chunker.py), starting at 'start_date'.
+    The text file is tokenized once for all the platforms whose chunk index
+    needs building. With balanced, each platform's posts are about the same
+    length. Returns {platform name: BotTweet}.
+    """
+    if botname is None:
+        botname = BotTweet._get_botname()
+    limits = {platform: backends.BACKENDS[platform].limit for platform in platforms}
+    indexes = chunk_index.limit_indexes(
+        get_tweet_filename(textfile), set(limits.values()), use_lines, balanced
+    )
+    posts = {}
+    for platform, limit in limits.items():
+        index = indexes[limit]
+        posts[platform] = index.tweet(get_today_index(len(index), start_date), botname)
+    return posts
@@ -0,0 +1,434 @@
+"""
+Publishing backends (Twitter, Mastodon, Bluesky) and concurrent fan-out.
+
+Each backend posts text, or text with an image, for one bot. Every API call
+goes through the bot's rate limiter for that endpoint (see ratelimit.py),
+which paces calls and retries rate-limited or failed ones. fan_out runs a
+post on every enabled backend at once and collects a PublishResult per
+backend, so a post takes as long as the slowest backend rather than the sum.
+
+The platform libraries (Mastodon.py, Twython, requests) are imported when a
+backend first needs them, not with this module, so a bot that exits at
+run_recently, or only posts to Mastodon, doesn't pay to load the others.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import io
+import os
+import time
+from typing import TYPE_CHECKING, Callable, NamedTuple
+
+from tweetbot_lib import chunker, clients, credentials, media, ratelimit, tracing
+
+if TYPE_CHECKING:
+    from mastodon import Mastodon
+    import requests
+    from twython import Twython
+
+MASTODON_API_BASE_URL = "https://botsin.space/"
+TWITTER_API_URL = "https://api.twitter.com"
+TWITTER_UPLOAD_URL = "https://upload.twitter.com/1.1/media/upload.json"
+BLUESKY_API_BASE_URL = "https://bsky.social"
+
+# Seconds any one HTTP request may take to connect, or between bytes of the
+# response, before it fails (and is retried if the call has tries left):
+REQUEST_TIMEOUT = 60
+
+# If this environment variable is set, every backend talks to that server
+# instead (e.g. a local stand-in, see standin.py):
+STANDIN_URL_ENV = "TWEETBOT_STANDIN_URL"
+
+
+class PublishResult(NamedTuple):
+    """What one backend returned for a post, or the error it raised"""
+
+    backend: str
+    ok: bool
+    value: object = None
+    error: Exception = None
+
+
+class Backend:
+    """
+    A platform to publish to. Subclasses set 'name', 'default_base_url',
+    'limit' and 'media_reusable' and implement post, upload_media and
+    post_media.
+    """
+
+    name = None
+    default_base_url = None
+    limit = None  # the post length limit, a chunker.Limit
+    media_reusable = True  # can one upload be attached to several posts
+
+    def __init__(
+        self,
+        botname: str,
+        base_url: str = None,
+        attempts: int = ratelimit.MAX_ATTEMPTS,
+        max_wait: float = ratelimit.MAX_DELAY,
+    ) -> None:
+        self.botname = botname
+        standin_url = os.environ.get(STANDIN_URL_ENV)
+        self.base_url = base_url or standin_url or self.default_base_url
+        # How many times to try each call, and the longest to wait for the
+        # rate limiter before raising ratelimit.RateLimitExceeded:
+        self.attempts = attempts
+        self.max_wait = max_wait
+
+    def _get_client(self, factory: Callable[[], object]) -> object:
+        """
+        This bot's cached client for the platform, built with factory() on
+        first use and timed as the span 'client:<platform>' (which includes
+        importing the platform's library)
+        """
+
+        def _build():
+            with tracing.span(f"client:{self.name}"):
+                return factory()
+
+        return clients.get_client(self.botname, self.name, _build)
+
+    def _limited(self, endpoint: str, func: Callable, *args, **kwargs) -> object:
+        """
+        Call func(*args, **kwargs) through this bot's rate limiter for
+        'endpoint', timed as the span '<platform>.<endpoint>'
+        """
+        with tracing.span(f"{self.name}.{endpoint}"):
+            return ratelimit.call(
+                ratelimit.bucket(self.botname, self.name, endpoint),
+                lambda: func(*args, **kwargs),
+                self._rate_headers,
+                self._retryable,
+                attempts=self.attempts,
+                max_wait=self.max_wait,
+            )
+
+    def _rate_headers(self, outcome: object) -> dict:
+        """Rate-limit headers of the call that returned or raised 'outcome'"""
+        return None
+
+    def _retryable(self, err: Exception) -> bool:
+        """Is a call that raised 'err' worth trying again"""
+        import requests  # pylint: disable=import-outside-toplevel
+
+        return isinstance(err, (requests.ConnectionError, requests.Timeout))
+
+    def post(self, text: str, key: str = None) -> object:
+        """
+        Post 'text', returning the platform's response. Platforms that take
+        an idempotency key (Mastodon) post it only once per 'key'.
+        """
+        raise NotImplementedError
+
+    def upload_media(self, data: bytes) -> tuple[object, float]:
+        """
+        Upload a JPEG image's bytes. Returns (media reference, seconds until the
+        upload expires); the reference must be JSON-serializable.
+        """
+        raise NotImplementedError
+
+    def post_media(self, text: str, media_ref: object, key: str = None) -> object:
+        """Post 'text' with an uploaded image attached (key: as for post)"""
+        raise NotImplementedError
+
+    def post_with_image(
+        self, text: str, image: str | bytes, digest: str = None, key: str = None
+    ) -> object:
+        """
+        Post 'text' with a JPEG image (its path, or its bytes) attached,
+        reusing an earlier upload of the same image (digest: its sha256, if
+        already known; key: as for post)
+        """
+        return media.post_with_image(self, text, image, digest, key)
+
+    def schedule(self, text: str, when: datetime.datetime) -> object:
+        """
+        Have the server post 'text' at 'when'. Only for platforms with
+        server-side scheduled posts.
+        """
+        raise NotImplementedError(f"{self.name} has no scheduled posts")
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.botname!r})"
+
+
+class TwitterBackend(Backend):
+    """Twitter, through the bot's cached Twython client"""
+
+    name = "twitter"
+    default_base_url = TWITTER_API_URL
+    limit = chunker.Limit(280, url_len=23, weighted=True)
+
+    @property
+    def client(self) -> Twython:
+        """The bot's cached Twython client (one OAuth session per bot)"""
+
+        def _make():
+            from twython import Twython  # pylint: disable=import-outside-toplevel
+
+            twitter = Twython(
+                *credentials.twitter_keys(self.botname),
+                client_args={"timeout": REQUEST_TIMEOUT},
+            )
+            twitter.api_url = f"{self.base_url}/%s"
+            return twitter
+
+        return self._get_client(_make)
+
+    def _rate_headers(self, outcome: object) -> dict:
+        # Twython keeps the last response's headers, even for an error status:
+        last_call = self.client._last_call  # pylint: disable=protected-access
+        if last_call is None:
+            return None
+        if isinstance(outcome, Exception) and getattr(outcome, "error_code", None) is None:
+            return None  # no response at all
+        return last_call["headers"]
+
+    def _retryable(self, err: Exception) -> bool:
+        # pylint: disable-next=import-outside-toplevel
+        from twython.exceptions import TwythonError, TwythonRateLimitError
+
+        if isinstance(err, TwythonRateLimitError):
+            return True
+        if isinstance(err, TwythonError):
+            # Twython turns connection errors into a TwythonError without a status
+            return err.error_code is None or err.error_code >= 500
+        return super()._retryable(err)
+
+    def post(self, text: str, key: str = None) -> object:
+        return self._limited("statuses/update", self.client.update_status, status=text)
+
+    def reply(self, text: str, status_id: int) -> object:
+        """Post 'text' as a reply to tweet 'status_id'"""
+        return self._limited(
+            "statuses/update",
+            self.client.update_status,
+            status=text,
+            in_reply_to_status_id=status_id,
+        )
+
+    def upload_media(self, data: bytes) -> tuple[object, float]:
+        # Media goes to its own host, unless we're pointed at a stand-in:
+        upload_url = TWITTER_UPLOAD_URL
+        if self.base_url != TWITTER_API_URL:
+            upload_url = "media/upload"
+
+        def _upload():
+            return self.client.post(upload_url, params={"media": io.BytesIO(data)})
+
+        response = self._limited("media/upload", _upload)
+        return response["media_id"], response.get("expires_after_secs", 86400)
+
+    def post_media(self, text: str, media_ref: object, key: str = None) -> object:
+        return self._limited(
+            "statuses/update", self.client.update_status, status=text, media_ids=[media_ref]
+        )
+
+
+class MastodonBackend(Backend):
+    """Mastodon, through the bot's cached Mastodon client"""
+
+    name = "mastodon"
+    default_base_url = MASTODON_API_BASE_URL
+    limit = chunker.Limit(500, url_len=23)
+    media_reusable = False  # an attachment belongs to one status
+
+    @property
+    def client(self) -> Mastodon:
+        """
+        The bot's cached Mastodon client. Mastodon sends the access token per
+        request, so all bots share one HTTP session and its connections. Rate
+        limits are left to our limiter rather than Mastodon.py's own waiting.
+        """
+
+        def _make():
+            from mastodon import Mastodon  # pylint: disable=import-outside-toplevel
+
+            return Mastodon(
+                access_token=credentials.mastodon_access_token(self.botname),
+                api_base_url=self.base_url,
+                session=clients.get_session(self.name),
+                ratelimit_method="throw",
+                request_timeout=REQUEST_TIMEOUT,
+            )
+
+        return self._get_client(_make)
+
+    def _rate_headers(self, outcome: object) -> dict:
+        # Mastodon.py parses the headers into attributes; its reset time has
+        # already been corrected for the server's clock.
+        client = self.client
+        if client.ratelimit_reset <= time.time():
+            return None  # no rate-limit headers seen in this window
+        return {
+            "X-RateLimit-Limit": client.ratelimit_limit,
+            "X-RateLimit-Remaining": client.ratelimit_remaining,
+            "X-RateLimit-Reset": client.ratelimit_reset,
+        }
+
+    def _retryable(self, err: Exception) -> bool:
+        # pylint: disable-next=import-outside-toplevel
+        from mastodon.errors import (
+            MastodonNetworkError,
+            MastodonRatelimitError,
+            MastodonServerError,
+        )
+
+        if isinstance(err, (MastodonRatelimitError, MastodonServerError, MastodonNetworkError)):
+            return True
+        return super()._retryable(err)
+
+    def post(self, text: str, key: str = None) -> object:
+        return self._limited("statuses", self.client.status_post, text, idempotency_key=key)
+
+    def upload_media(self, data: bytes) -> tuple[object, float]:
+        # Unattached uploads are cleaned up after a day:
+        media_dict = self._limited(
+            "media", self.client.media_post, mime_type="image/jpeg", media_file=data
+        )
+        return str(media_dict["id"]), 86400
+
+    def post_media(self, text: str, media_ref: object, key: str = None) -> object:
+        return self._limited(
+            "statuses",
+            self.client.status_post,
+            text,
+            media_ids=[media_ref],
+            idempotency_key=key,
+        )
+
+    def schedule(self, text: str, when: datetime.datetime) -> object:
+        return self._limited(
+            "statuses", self.client.status_post, text, scheduled_at=when.astimezone()
+        )
+
+
+class BlueskyBackend(Backend):
+    """Bluesky, through the AT Protocol XRPC endpoints"""
+
+    name = "bluesky"
+    default_base_url = BLUESKY_API_BASE_URL
+    limit = chunker.Limit(300)
+
+    @property
+    def session(self) -> requests.Session:
+        """Shared HTTP session (the auth token is sent per request)"""
+        return clients.get_session(self.name)
+
+    def _rate_headers(self, outcome: object) -> dict:
+        import requests  # pylint: disable=import-outside-toplevel
+
+        if isinstance(outcome, requests.HTTPError):
+            outcome = outcome.response
+        return outcome.headers if isinstance(outcome, requests.Response) else None
+
+    def _retryable(self, err: Exception) -> bool:
+        import requests  # pylint: disable=import-outside-toplevel
+
+        if isinstance(err, requests.HTTPError):
+            status = err.response.status_code
+            return status == 429 or status >= 500
+        return super()._retryable(err)
+
+    def _send(self, method: str, expired_ok: bool = False, **kwargs) -> requests.Response:
+        """
+        POST to an XRPC procedure through the rate limiter. With expired_ok,
+        an expired-token response is returned instead of raised.
+        """
+
+        def _post():
+            resp = self.session.post(
+                f"{self.base_url}/xrpc/{method}", timeout=REQUEST_TIMEOUT, **kwargs
+            )
+            if not (expired_ok and _token_expired(resp)):
+                resp.raise_for_status()
+            return resp
+
+        return self._limited(method, _post)
+
+    def _login(self) -> dict:
+        """Create an XRPC session: {'accessJwt': ..., 'did': ..., ...}"""
+        handle, password = credentials.bluesky_login(self.botname)
+        return self._send(
+            "com.atproto.server.createSession",
+            json={"identifier": handle, "password": password},
+        ).json()
+
+    def _xrpc(self, method: str, retry: bool = True, **kwargs) -> dict:
+        """Call an XRPC procedure as this bot, logging in again if the token expired"""
+        login = self._get_client(self._login)
+        headers = dict(kwargs.pop("headers", {}))
+        headers["Authorization"] = f"Bearer {login['accessJwt']}"
+        resp = self._send(method, expired_ok=retry, headers=headers, **kwargs)
+        if retry and _token_expired(resp):
+            clients.forget(self.botname, self.name)
+            return self._xrpc(method, retry=False, headers=headers, **kwargs)
+        return resp.json()
+
+    def _create_post(self, text: str, embed: dict = None) -> dict:
+        """Create an app.bsky.feed.post record"""
+        login = self._get_client(self._login)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        record = {
+            "$type": "app.bsky.feed.post",
+            "text": text,
+            "createdAt": now.isoformat().replace("+00:00", "Z"),
+        }
+        if embed is not None:
+            record["embed"] = embed
+        return self._xrpc(
+            "com.atproto.repo.createRecord",
+            json={"repo": login["did"], "collection": "app.bsky.feed.post", "record": record},
+        )
+
+    def post(self, text: str, key: str = None) -> object:
+        return self._create_post(text)
+
+    def upload_media(self, data: bytes) -> tuple[object, float]:
+        # A blob that isn't referenced by a record is only kept for a while:
+        blob = self._xrpc(
+            "com.atproto.repo.uploadBlob",
+            data=data,
+            headers={"Content-Type": "image/jpeg"},
+        )["blob"]
+        return blob, 3600
+
+    def post_media(self, text: str, media_ref: object, key: str = None) -> object:
+        embed = {
+            "$type": "app.bsky.embed.images",
+            "images": [{"alt": text, "image": media_ref}],
+        }
+        return self._create_post(text, embed)
+
+
+# Backend classes by platform name:
+BACKENDS = {b.name: b for b in (TwitterBackend, MastodonBackend, BlueskyBackend)}
+
+
+def _token_expired(resp: requests.Response) -> bool:
+    """Is this XRPC response an expired access token"""
+    return resp.status_code in (400, 401) and "ExpiredToken" in resp.text
+
+
+def fan_out(backends: list[Backend], call: Callable[[Backend], object]) -> dict:
+    """
+    Run call(backend) for every backend at once. Returns
+    {backend name: PublishResult}; errors are collected, not raised.
+    """
+
+    def _call(backend: Backend) -> PublishResult:
+        try:
+            value = call(backend)
+        except Exception as err:  # pylint: disable=broad-except
+            print(f"{backend.name} error: {err!r}")
+            return PublishResult(backend.name, False, error=err)
+        return PublishResult(backend.name, True, value=value)
+
+    if len(backends) <= 1:
+        return {b.name: _call(b) for b in backends}
+
+    with ThreadPoolExecutor(max_workers=len(backends)) as pool:
+        return {r.backend: r for r in tracing.map(pool, _call, backends)}
@@ -0,0 +1,372 @@
+"""
+Persistent chunk-offset index for the text files in txt/.
+
+The index lives next to the text file (e.g. txt/gettysburg.txt.idx). It is a
+one-line JSON header followed by a fixed-width (offset, length) byte span per
+chunk, so finding today's chunk is a seek into the index and a seek into the
+text file, with no tokenizing. The header records what the chunking depends
+on (file size/mtime/sha256, MAX_TWEET_LEN, use_lines), and the index is
+rebuilt automatically when any of those change.
+
+Indexes for a platform's Limit (see chunker.py) get their own file, named
+for the limit (e.g. txt/gettysburg.txt.greedy-500-u23.idx). limit_indexes
+builds the ones that are missing or stale for several limits from one
+tokenization of the text file.
+"""
+
+import contextlib
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+from typing import Iterable, Iterator
+
+import tweetbot_lib
+from tweetbot_lib import chunker
+
+INDEX_VERSION = 2
+INDEX_SUFFIX = ".idx"
+
+_RECORD = struct.Struct("<QQ")  # (byte offset, byte length) of one chunk
+
+# UTF-8 encoded whitespace, the same set that str.split() splits on. Words
+# are the gaps between runs of it.
+_SPACE_RE = re.compile(
+    rb"(?:[\x09-\x0d\x1c-\x20]"
+    rb"|\xc2[\x85\xa0]"
+    rb"|\xe1\x9a\x80"
+    rb"|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]"
+    rb"|\xe2\x81\x9f"
+    rb"|\xe3\x80\x80)+"
+)
+
+# A line, with the same universal newlines that text-mode readlines() uses:
+_LINE_RE = re.compile(rb"[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+\Z")
+
+
+def _word_spans(data) -> Iterator[tuple[int, int]]:
+    """(start, end) byte positions of each whitespace-separated word in 'data'"""
+    start = 0
+    for match in _SPACE_RE.finditer(data):
+        if match.start() > start:
+            yield start, match.start()
+        start = match.end()
+    if len(data) > start:
+        yield start, len(data)
+
+
+def iter_words(data) -> Iterator[str]:
+    """Decoded whitespace-separated words of the UTF-8 bytes 'data'"""
+    for start, end in _word_spans(data):
+        yield data[start:end].decode("utf-8")
+
+
+def line_text(data: bytes) -> str:
+    """Decode one line's bytes, translating its newline as text mode would"""
+    text = data.decode("utf-8")
+    if text.endswith("\r\n"):
+        return text[:-2] + "\n"
+    if text.endswith("\r"):
+        return text[:-1] + "\n"
+    return text
+
+
+def iter_lines(data) -> Iterator[str]:
+    """Decoded lines of the UTF-8 bytes 'data', like text-mode readlines()"""
+    for match in _LINE_RE.finditer(data):
+        yield line_text(match.group())
+
+
+@contextlib.contextmanager
+def mapped(filename: str):
+    """Read-only mmap of a file (empty bytes for an empty file)"""
+    with open(filename, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+def _word_chunk_spans(data, max_len: int = None) -> Iterator[tuple[int, int]]:
+    """
+    Byte spans of the chunks tweetify_text makes from 'data' by packing words.
+    Drives a BotTweet the same way pack_words does, so the boundaries match.
+    """
+    tweet = tweetbot_lib.BotTweet(botname="", max_len=max_len)
+    start = end = 0
+    for word_start, word_end in _word_spans(data):
+        word = data[word_start:word_end].decode("utf-8")
+        if tweet.can_take_new_word(word):
+            if not tweet.words:
+                start = word_start
+            tweet.append(word)
+        else:
+            yield start, end - start
+            tweet = tweetbot_lib.BotTweet(word, botname="", max_len=max_len)
+            start = word_start
+        end = word_end
+    yield start, end - start
+
+
+def _line_chunk_spans(data) -> Iterator[tuple[int, int]]:
+    """Byte spans of the lines in 'data'"""
+    for match in _LINE_RE.finditer(data):
+        yield match.start(), match.end() - match.start()
+
+
+def chunk_spans(
+    data, use_lines: bool = False, max_len: int = None
+) -> Iterator[tuple[int, int]]:
+    """(offset, length) byte spans of each chunk in the UTF-8 bytes 'data'"""
+    if use_lines:
+        return _line_chunk_spans(data)
+    return _word_chunk_spans(data, max_len)
+
+
+def limit_chunk_spans(
+    data, limits: Iterable[chunker.Limit], use_lines: bool = False, balanced: bool = False
+) -> dict:
+    """
+    Chunk the UTF-8 bytes 'data' for each of 'limits', tokenizing it once.
+    Returns {limit: [(offset, length) byte span of each chunk]}.
+    """
+    limits = list(limits)
+    if use_lines:
+        spans = list(_line_chunk_spans(data))
+        return {limit: spans for limit in limits}
+
+    spans = list(_word_spans(data))
+    if not spans:
+        return {limit: [(0, 0)] for limit in limits}
+    words = [data[start:end].decode("utf-8") for start, end in spans]
+
+    chunkings = {}
+    for limit in limits:
+        lens = [limit.word_len(word) for word in words]
+        firsts = chunker.breaks(lens, limit.max_len, balanced)
+        lasts = [i - 1 for i in firsts[1:]] + [len(spans) - 1]
+        chunkings[limit] = [
+            (spans[first][0], spans[last][1] - spans[first][0])
+            for first, last in zip(firsts, lasts)
+        ]
+    return chunkings
+
+
+def chunk_tweet(
+    data: bytes,
+    use_lines: bool = False,
+    botname: str = None,
+    max_len: int = None,
+    limit: chunker.Limit = None,
+) -> "tweetbot_lib.BotTweet":
+    """
+    Make the BotTweet for one chunk's bytes, as tweetify_text would, or as
+    packed for 'limit' (words cut by its weighted length, URLs never cut)
+    """
+    if limit is not None:
+        return _limit_chunk_tweet(data, use_lines, botname, limit)
+    if use_lines:
+        return tweetbot_lib.BotTweet(line_text(data), botname=botname, max_len=max_len)
+
+    tweet = tweetbot_lib.BotTweet(botname=botname, max_len=max_len)
+    for word in data.decode("utf-8").split():
+        tweet.append(word)
+    return tweet
+
+
+def _limit_chunk_tweet(
+    data: bytes, use_lines: bool, botname: str, limit: chunker.Limit
+) -> "tweetbot_lib.BotTweet":
+    """chunk_tweet for a chunk packed by limit_chunk_spans"""
+    if use_lines:
+        words = [limit.truncate(line_text(data))]
+    else:
+        words = [limit.truncate(word) for word in data.decode("utf-8").split()]
+    tweet = tweetbot_lib.BotTweet(botname=botname, max_len=limit.max_len)
+    tweet.words = words  # already cut to fit; BotTweet would cut by characters
+    lone_url = len(words) == 1 and words[0].startswith(chunker.URL_PREFIXES)
+    if limit.text_len(tweet.str) > limit.max_len and not lone_url:
+        raise ValueError(f"chunk packed over {limit}: {tweet.str!r}")
+    return tweet
+
+
+def _sha256(filename: str) -> str:
+    """Hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ChunkIndex:
+    """
+    On-disk index of the chunk byte spans of one text file. Chunks are packed
+    like tweetify_text (max_len, MAX_TWEET_LEN by default), or for a
+    platform's 'limit' (greedy, or 'balanced'; see chunker.py).
+    """
+
+    def __init__(
+        self,
+        textfile: str,
+        use_lines: bool = False,
+        max_len: int = None,
+        limit: chunker.Limit = None,
+        balanced: bool = False,
+        build: bool = True,
+    ) -> None:
+        self.textfile = textfile
+        self.use_lines = use_lines
+        self.limit = limit
+        self.balanced = balanced
+        if limit is not None:
+            self.max_len = limit.max_len
+            packing = "balanced" if balanced else "greedy"
+            url = "" if limit.url_len is None else f"-u{limit.url_len}"
+            weighted = "-w" if limit.weighted else ""
+            self.path = f"{textfile}.{packing}-{limit.max_len}{url}{weighted}{INDEX_SUFFIX}"
+        else:
+            self.max_len = tweetbot_lib.MAX_TWEET_LEN if max_len is None else max_len
+            self.path = f"{textfile}{INDEX_SUFFIX}"
+        self._spans = None  # in-memory fallback if the index can't be written
+        self._header_len = 0
+        self.header = self._load()
+        if self.header is None and build:
+            self.header = self._build()
+
+    def _key(self, stat: os.stat_result) -> dict:
+        """The header values that the chunking depends on"""
+        key = {
+            "version": INDEX_VERSION,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "max_len": self.max_len,
+            "use_lines": self.use_lines,
+        }
+        if self.limit is not None:
+            key.update(
+                url_len=self.limit.url_len,
+                weighted=self.limit.weighted,
+                balanced=self.balanced,
+            )
+        return key
+
+    def _read_header(self) -> dict:
+        """Read the index file's header, or None if it's missing or corrupt"""
+        try:
+            with open(self.path, "rb") as fh:
+                line = fh.readline()
+            header = json.loads(line)
+        except (OSError, ValueError):
+            return None
+        self._header_len = len(line)
+        return header
+
+    def _load(self) -> dict:
+        """The existing index's header if it is still valid, else None"""
+        key = self._key(os.stat(self.textfile))
+        header = self._read_header()
+        if header is None:
+            return None
+        if all(header.get(k) == v for k, v in key.items()):
+            return header
+
+        # Touched but not changed (e.g. a fresh checkout): keep the spans
+        same_chunking = all(
+            header.get(k) == v for k, v in key.items() if k != "mtime_ns"
+        )
+        if same_chunking and header.get("sha256") == _sha256(self.textfile):
+            with open(self.path, "rb") as fh:
+                fh.seek(self._header_len)
+                records = fh.read()
+            header.update(key)
+            try:
+                self._write(header, records)
+            except OSError:
+                pass
+            return header
+        return None
+
+    def _build(self) -> dict:
+        """Tokenize the text file once and write its index"""
+        with mapped(self.textfile) as data:
+            if self.limit is None:
+                spans = list(chunk_spans(data, self.use_lines, self.max_len))
+            else:
+                spans = limit_chunk_spans(data, [self.limit], self.use_lines, self.balanced)[
+                    self.limit
+                ]
+            sha256 = hashlib.sha256(data).hexdigest()
+        return self._store(spans, sha256)
+
+    def _store(self, spans: list[tuple[int, int]], sha256: str) -> dict:
+        """Write the index for these chunk spans, returning its header"""
+        header = dict(self._key(os.stat(self.textfile)), sha256=sha256, count=len(spans))
+        records = b"".join(_RECORD.pack(*span) for span in spans)
+        try:
+            self._write(header, records)
+        except OSError:
+            self._spans = spans
+        return header
+
+    def _write(self, header: dict, records: bytes) -> None:
+        """Atomically replace the index file"""
+        line = json.dumps(header, sort_keys=True).encode("utf-8") + b"\n"
+        # One temp file per writer, so threads building the same index don't
+        # write into each other's:
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(line)
+            fh.write(records)
+        os.replace(tmp_path, self.path)
+        self._header_len = len(line)
+
+    def __len__(self) -> int:
+        return self.header["count"]
+
+    def span(self, index: int) -> tuple[int, int]:
+        """(offset, length) in bytes of chunk 'index' in the text file"""
+        if not 0 <= index < len(self):
+            raise IndexError(f"chunk index {index} out of range")
+        if self._spans is not None:
+            return self._spans[index]
+        with open(self.path, "rb") as fh:
+            fh.seek(self._header_len + index * _RECORD.size)
+            return _RECORD.unpack(fh.read(_RECORD.size))
+
+    def tweet(self, index: int, botname: str = None) -> "tweetbot_lib.BotTweet":
+        """Seek straight to chunk 'index' in the text file and make its BotTweet"""
+        offset, length = self.span(index)
+        with open(self.textfile, "rb") as fh:
+            fh.seek(offset)
+            data = fh.read(length)
+        return chunk_tweet(data, self.use_lines, botname, self.max_len, self.limit)
+
+
+def limit_indexes(
+    textfile: str,
+    limits: Iterable[chunker.Limit],
+    use_lines: bool = False,
+    balanced: bool = False,
+) -> dict:
+    """
+    {limit: ChunkIndex} for each of 'limits'. The ones that are missing or
+    stale are all built from one tokenization of the text file.
+    """
+    indexes = {
+        limit: ChunkIndex(textfile, use_lines, limit=limit, balanced=balanced, build=False)
+        for limit in limits
+    }
+    stale = [limit for limit, index in indexes.items() if index.header is None]
+    if stale:
+        with mapped(textfile) as data:
+            chunkings = limit_chunk_spans(data, stale, use_lines, balanced)
+            sha256 = hashlib.sha256(data).hexdigest()
+        for limit in stale:
+            # pylint: disable-next=protected-access
+            indexes[limit].header = indexes[limit]._store(chunkings[limit], sha256)
+    return indexes
@@ -0,0 +1,140 @@
+"""
+Pack words into posts for per-platform length limits.
+
+Each platform has its own Limit: a maximum length, and how it counts length
+(Twitter and Mastodon count any URL as 23 characters, and Twitter counts most
+non-Latin characters double). Packing works on the words' weighted lengths,
+so a text file is tokenized once (see chunk_index.limit_chunk_spans) and then
+packed for each limit. A word too long for a post is cut to fit by its weighted
+length; URLs are never cut, so a URL longer than a post goes in one by itself.
+
+Two packings: greedy fills each post in turn, which gives the fewest posts;
+balanced also gives the fewest posts but spreads the words so the posts come
+out about the same length, instead of leaving a short post wherever a long
+word didn't fit.
+"""
+
+from typing import NamedTuple
+
+URL_PREFIXES = ("http://", "https://")
+
+# Code points Twitter counts as one character; everything else counts two:
+_TWITTER_LIGHT_RANGES = ((0, 4351), (8192, 8205), (8208, 8223), (8242, 8247))
+
+
+def _twitter_weight(char: str) -> int:
+    code = ord(char)
+    return 1 if any(lo <= code <= hi for lo, hi in _TWITTER_LIGHT_RANGES) else 2
+
+
+class Limit(NamedTuple):
+    """A platform's post length limit and how it counts length"""
+
+    max_len: int
+    url_len: int = None  # URLs count as this many characters (None: as written)
+    weighted: bool = False  # count characters with Twitter's weights
+
+    def _counted_len(self, word: str) -> int:
+        """The length 'word' counts for, uncut"""
+        if self.url_len is not None and word.startswith(URL_PREFIXES):
+            return self.url_len
+        if self.weighted and not word.isascii():
+            return sum(_twitter_weight(c) for c in word)
+        return len(word)
+
+    def word_len(self, word: str) -> int:
+        """The length 'word' counts for, once cut to fit (see truncate)"""
+        if word.startswith(URL_PREFIXES):
+            return self._counted_len(word)
+        return min(self._counted_len(word), self.max_len)
+
+    def text_len(self, text: str) -> int:
+        """The length a post's text counts for"""
+        words = text.split(" ")
+        return sum(self.word_len(w) for w in words) + len(words) - 1
+
+    def _cut(self, word: str, room: int) -> str:
+        """The longest start of 'word' that counts for at most 'room'"""
+        if not self.weighted or word.isascii():
+            return word[:room]
+        used = 0
+        for i, char in enumerate(word):
+            used += _twitter_weight(char)
+            if used > room:
+                return word[:i]
+        return word
+
+    def truncate(self, text: str) -> str:
+        """
+        'text' cut to fit max_len by its counted length, between characters
+        of a word that doesn't fit. URLs are never cut: one that doesn't fit
+        is left off, unless it's the only word.
+        """
+        kept = []
+        used = -1  # the length of the words kept, and a space after each but the last
+        for word in text.split(" "):
+            length = self._counted_len(word)
+            if used + 1 + length <= self.max_len:
+                kept.append(word)
+                used += 1 + length
+                continue
+            if word.startswith(URL_PREFIXES):
+                if not kept:
+                    kept.append(word)
+            elif self.max_len - used - 1 > 0:
+                kept.append(self._cut(word, self.max_len - used - 1))
+            break
+        return " ".join(kept)
+
+
+def greedy_breaks(lens: list[int], max_len: int) -> list[int]:
+    """
+    Index of the first word of each post, filling each post with as many
+    words (of lengths 'lens', joined by single spaces) as fit in max_len
+    """
+    breaks = []
+    used = None  # length of the current post, None before the first word
+    for i, length in enumerate(lens):
+        if used is not None and used + 1 + length <= max_len:
+            used += 1 + length
+        else:
+            breaks.append(i)
+            used = length
+    return breaks
+
+
+def balanced_breaks(lens: list[int], max_len: int) -> list[int]:
+    """
+    Index of the first word of each post, for the fewest posts and, among
+    those, the smallest sum of squared unused space per post
+    """
+    num = len(lens)
+    # best[i]: (posts, cost) of the best packing of the first i words, and
+    # start[i]: where its last post starts
+    best = [(0, 0)] + [None] * num
+    start = [0] * (num + 1)
+    for end in range(1, num + 1):
+        width = -1
+        for first in range(end - 1, -1, -1):
+            width += lens[first] + 1
+            if width > max_len and first < end - 1:
+                break
+            posts, cost = best[first]
+            candidate = (posts + 1, cost + (max_len - width) ** 2)
+            if best[end] is None or candidate < best[end]:
+                best[end] = candidate
+                start[end] = first
+
+    breaks = []
+    end = num
+    while end > 0:
+        end = start[end]
+        breaks.append(end)
+    return breaks[::-1]
+
+
+def breaks(lens: list[int], max_len: int, balanced: bool = False) -> list[int]:
+    """Index of the first word of each post, greedy or balanced"""
+    if balanced:
+        return balanced_breaks(lens, max_len)
+    return greedy_breaks(lens, max_len)
@@ -0,0 +1,80 @@
+"""
+Process-wide registry of platform clients, so a bot that posts more than once
+(or a long-lived process hosting many bots) builds each client once and
+reuses its HTTP session and keep-alive connections.
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING, Callable
+
+if TYPE_CHECKING:
+    import requests
+
+POOL_MAXSIZE = 16
+
+_lock = threading.Lock()
+_clients = {}
+_key_locks = {}
+_sessions = {}
+
+
+def get_client(botname: str, platform: str, factory: Callable[[], object]) -> object:
+    """
+    The client for (botname, platform), built with factory() on first use.
+    Safe to call from several threads; factory() runs once per key, outside
+    the registry lock, so it may itself call get_session.
+    """
+    key = (botname, platform)
+    with _lock:
+        client = _clients.get(key)
+        if client is not None:
+            return client
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    # Build outside the registry lock: a factory that calls get_session would
+    # deadlock on it, and a slow login for one client shouldn't hold up the
+    # others.
+    with key_lock:
+        with _lock:
+            client = _clients.get(key)
+        if client is None:
+            client = factory()
+            with _lock:
+                _clients[key] = client
+    return client
+
+
+def forget(botname: str, platform: str) -> None:
+    """Drop the cached client for (botname, platform), e.g. if its login expired"""
+    with _lock:
+        _clients.pop((botname, platform), None)
+
+
+def get_session(name: str) -> requests.Session:
+    """
+    A shared requests.Session for 'name' (e.g. a platform whose clients send
+    their own auth headers per request), with a connection pool big enough
+    for threaded use. requests is only imported once a session is needed.
+    """
+    import requests  # pylint: disable=import-outside-toplevel
+    from requests.adapters import HTTPAdapter  # pylint: disable=import-outside-toplevel
+
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = _sessions[name] = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_MAXSIZE, pool_maxsize=POOL_MAXSIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+    return session
+
+
+def clear() -> None:
+    """Forget all cached clients and close the shared sessions"""
+    with _lock:
+        _clients.clear()
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
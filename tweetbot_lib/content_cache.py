@@ -0,0 +1,143 @@
+"""
+On-disk content cache with a byte budget and least-recently-used eviction.
+
+Each entry is a file in the cache's directory, named by its key's hash, with
+a row in the directory's index database: the entry's size, when it was last
+used, and any stats the caller stored with it (e.g. how dark an image is),
+so a hit can be judged without reading the content back. Adding an entry
+evicts the least recently used ones until the cache fits its budget.
+
+Entries are written to a temporary name and renamed into place, so several
+threads or processes can share a cache.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+INDEX_DB = "index.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL,
+    stats TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+"""
+
+
+# Cache directories whose index schema this process has already created, so
+# _connect only does it once per directory:
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+def _initialize(conn: sqlite3.Connection, directory: str) -> None:
+    """Create the index schema (in WAL mode) for 'directory', once per process"""
+    key = os.path.abspath(directory)
+    with _init_lock:
+        if key in _initialized:
+            return
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _initialized.add(key)
+
+
+class CacheEntry(NamedTuple):
+    """A cached file and what was stored with it"""
+
+    path: str
+    size: int
+    stats: dict
+
+
+class ContentCache:
+    """A directory of cached files, at most max_bytes in all"""
+
+    def __init__(self, directory: str, max_bytes: int, suffix: str = "") -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix  # the files' extension, e.g. ".jpg"
+
+    @contextlib.contextmanager
+    def _connect(self):
+        os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(
+            os.path.join(self.directory, INDEX_DB), timeout=30, isolation_level=None
+        )
+        try:
+            _initialize(conn, self.directory)
+            yield conn
+        finally:
+            conn.close()
+
+    def _filename(self, key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest() + self.suffix
+
+    def get(self, key: str) -> CacheEntry:
+        """The entry for 'key', marked as just used, or None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT filename, size, stats FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            filename, size, stats = row
+            path = os.path.join(self.directory, filename)
+            if not os.path.exists(path):  # deleted behind the cache's back
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE entries SET used = ? WHERE key = ?", (time.time(), key))
+        return CacheEntry(path, size, json.loads(stats) if stats else {})
+
+    def put(self, key: str, data: bytes, stats: dict = None) -> CacheEntry:
+        """Store 'data' (and 'stats') under 'key', then evict down to the budget"""
+        filename = self._filename(key)
+        path = os.path.join(self.directory, filename)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, filename, size, used, stats) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, filename, len(data), time.time(), json.dumps(stats or {})),
+            )
+        self.evict()
+        return CacheEntry(path, len(data), stats or {})
+
+    def evict(self) -> int:
+        """Delete the least recently used entries until the cache fits. Returns bytes freed."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            evicted = []
+            if total > self.max_bytes:
+                for key, filename, size in conn.execute(
+                    "SELECT key, filename, size FROM entries ORDER BY used"
+                ):
+                    evicted.append((key, filename, size))
+                    total -= size
+                    if total <= self.max_bytes:
+                        break
+            conn.executemany("DELETE FROM entries WHERE key = ?", [(e[0],) for e in evicted])
+            conn.execute("COMMIT")
+        for _, filename, _ in evicted:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.directory, filename))
+        return sum(size for _, _, size in evicted)
+
+    def size(self) -> int:
+        """Bytes cached"""
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
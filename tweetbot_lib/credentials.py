@@ -0,0 +1,134 @@
+"""
+Credential store for the bots' secrets files.
+
+Each file is parsed once into a dict indexed by botname and re-parsed only
+when its mtime (or size) changes, so a process hosting many bots pays one
+parse per file instead of one per key lookup. The default files are
+KEYFILE, TOKENFILE and BLUESKYFILE, looked up at call time; the
+TWEETBOT_KEYFILE, TWEETBOT_TOKENFILE and TWEETBOT_BLUESKYFILE environment
+variables override them.
+"""
+
+import os
+import threading
+from typing import Callable, Iterable
+
+from tweetbot_lib import tracing
+
+KEYFILE = os.environ.get(
+    "TWEETBOT_KEYFILE", os.path.join(os.path.dirname(__file__), "../keys.txt")
+)
+TOKENFILE = os.environ.get(
+    "TWEETBOT_TOKENFILE",
+    os.path.join(os.path.dirname(__file__), "../mastodon_access_tokens.secret"),
+)
+BLUESKYFILE = os.environ.get(
+    "TWEETBOT_BLUESKYFILE",
+    os.path.join(os.path.dirname(__file__), "../bluesky_app_passwords.secret"),
+)
+
+TWITTER_KEYNAMES = ["APP_KEY", "APP_SEC", "OAUTH_TOKEN", "OAUTH_TOKEN_SEC"]
+
+# Longest first, so OAUTH_TOKEN_SEC isn't read as OAUTH_TOKEN with a "_SEC" botname:
+_KEYNAMES_BY_LENGTH = sorted(TWITTER_KEYNAMES, key=len, reverse=True)
+
+_lock = threading.Lock()
+_cache = {}  # (path, parser) -> ((mtime_ns, size), parsed dict)
+
+
+def _parse_twitter_keys(fh) -> dict:
+    """
+    Parse keys.txt rows like 'twitter_gettysburg.pyAPP_KEY=foo' into
+    {botname: {keyname: value}}
+    """
+    keys = {}
+    for row in fh:
+        row = row.strip()
+        if not row:
+            continue
+        name, value = row.split("=", 1)
+        for keyname in _KEYNAMES_BY_LENGTH:
+            if name.endswith(keyname):
+                botname = name[: -len(keyname)]
+                keys.setdefault(botname, {})[keyname] = value
+                break
+    return keys
+
+
+def _parse_mastodon_tokens(fh) -> dict:
+    """Parse 'botname token' rows into {botname: token}. Later rows win."""
+    tokens = {}
+    for row in fh:
+        row = row.strip()
+        if not row:
+            continue
+        name, value = row.split()
+        tokens[name] = value
+    return tokens
+
+
+def _parse_bluesky_logins(fh) -> dict:
+    """Parse 'botname handle app_password' rows into {botname: (handle, password)}"""
+    logins = {}
+    for row in fh:
+        row = row.strip()
+        if not row:
+            continue
+        name, handle, password = row.split()
+        logins[name] = (handle, password)
+    return logins
+
+
+def _load(path: str, parser: Callable) -> dict:
+    """The parsed contents of 'path', re-parsed only if the file changed"""
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _cache.get((path, parser))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with tracing.span("credentials.parse"), open(path, encoding="utf-8") as fh:
+            parsed = parser(fh)
+        _cache[(path, parser)] = (version, parsed)
+    return parsed
+
+
+def twitter_keys(botname: str, keyfile: str = None) -> list[str]:
+    """The APP_KEY, APP_SEC, OAUTH_TOKEN, OAUTH_TOKEN_SEC list for botname"""
+    bot_keys = _load(keyfile or KEYFILE, _parse_twitter_keys).get(botname, {})
+    try:
+        return [bot_keys[n] for n in TWITTER_KEYNAMES]
+    except KeyError as err:
+        raise KeyError(f"{botname}{err.args[0]}") from None
+
+
+def twitter_keys_bulk(botnames: Iterable[str], keyfile: str = None) -> dict:
+    """{botname: twitter key list} for every botname that has all its keys"""
+    keys = _load(keyfile or KEYFILE, _parse_twitter_keys)
+    return {
+        b: [keys[b][n] for n in TWITTER_KEYNAMES]
+        for b in botnames
+        if b in keys and all(n in keys[b] for n in TWITTER_KEYNAMES)
+    }
+
+
+def mastodon_access_token(botname: str, tokenfile: str = None) -> str:
+    """The Mastodon access token for botname, or None if it has none"""
+    return _load(tokenfile or TOKENFILE, _parse_mastodon_tokens).get(botname)
+
+
+def mastodon_access_tokens(botnames: Iterable[str], tokenfile: str = None) -> dict:
+    """{botname: access token (or None)} for each of botnames"""
+    tokens = _load(tokenfile or TOKENFILE, _parse_mastodon_tokens)
+    return {b: tokens.get(b) for b in botnames}
+
+
+def bluesky_login(botname: str, loginfile: str = None) -> tuple[str, str]:
+    """The (handle, app password) for botname's Bluesky account"""
+    return _load(loginfile or BLUESKYFILE, _parse_bluesky_logins)[botname]
+
+
+def clear() -> None:
+    """Forget all parsed files"""
+    with _lock:
+        _cache.clear()
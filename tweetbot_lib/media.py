@@ -0,0 +1,112 @@
+"""
+Upload-once media for the publishing backends.
+
+Images are files, or their encoded bytes held in memory, identified by the
+sha256 of their bytes. The media reference each platform returns for an
+upload is cached in the state store (per bot, platform and hash, with the
+platform's expiry), so a retry or repost of the same image reuses it instead
+of uploading again. Platforms whose media can
+only be attached to one post (Mastodon) stop reusing an upload once a post
+with it succeeds.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+
+from tweetbot_lib import state
+
+
+def image_hash(image: str | bytes) -> str:
+    """sha256 hex digest of an image file, or of an image's bytes"""
+    if isinstance(image, bytes):
+        return hashlib.sha256(image).hexdigest()
+    digest = hashlib.sha256()
+    with open(image, "rb") as image_file:
+        for block in iter(lambda: image_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def image_bytes(image: str | bytes) -> bytes:
+    """An image's bytes, read from its file if it's a path"""
+    if isinstance(image, bytes):
+        return image
+    with open(image, "rb") as image_file:
+        return image_file.read()
+
+
+def cached_ref(botname: str, platform: str, digest: str, path: str = None) -> object:
+    """The unexpired, still-usable media reference for an image, or None"""
+    with state.connect(path) as conn:
+        row = conn.execute(
+            "SELECT media_ref FROM media WHERE botname = ? AND platform = ? "
+            "AND sha256 = ? AND expires_at > ? AND NOT used_up",
+            (botname, platform, digest, time.time()),
+        ).fetchone()
+    return None if row is None else json.loads(row[0])
+
+
+def cache_ref(
+    botname: str, platform: str, digest: str, media_ref: object, ttl: float, path: str = None
+) -> None:
+    """Remember an upload's media reference until it expires"""
+    with state.connect(path) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO media "
+            "(botname, platform, sha256, media_ref, expires_at, used_up) "
+            "VALUES (?, ?, ?, ?, ?, 0)",
+            (botname, platform, digest, json.dumps(media_ref), time.time() + ttl),
+        )
+
+
+def use_up(botname: str, platform: str, digest: str, path: str = None) -> None:
+    """Stop reusing an upload (it has been attached to a post, or was rejected)"""
+    with state.connect(path) as conn:
+        conn.execute(
+            "UPDATE media SET used_up = 1 WHERE botname = ? AND platform = ? AND sha256 = ?",
+            (botname, platform, digest),
+        )
+
+
+def upload(backend, image: str | bytes, digest: str) -> tuple[object, bool]:
+    """
+    The backend's media reference for the image (a path or its bytes),
+    uploading only if needed. Returns (media_ref, was_cached).
+    """
+    media_ref = cached_ref(backend.botname, backend.name, digest)
+    if media_ref is not None:
+        return media_ref, True
+
+    media_ref, ttl = backend.upload_media(image_bytes(image))
+    cache_ref(backend.botname, backend.name, digest, media_ref, ttl)
+    return media_ref, False
+
+
+def post_with_image(
+    backend, text: str, image: str | bytes, digest: str = None, key: str = None
+) -> object:
+    """
+    Post 'text' with the image (a path or its bytes) on one backend (key:
+    its idempotency key, see Backend.post), reusing an earlier upload of
+    the same image if there is one. If a reused upload is rejected, upload
+    again once.
+    """
+    if digest is None:
+        digest = image_hash(image)
+
+    media_ref, was_cached = upload(backend, image, digest)
+    try:
+        response = backend.post_media(text, media_ref, key)
+    except Exception:  # pylint: disable=broad-except
+        if not was_cached:
+            raise
+        use_up(backend.botname, backend.name, digest)
+        media_ref, _ = upload(backend, image, digest)
+        response = backend.post_media(text, media_ref, key)
+
+    if not backend.media_reusable:
+        use_up(backend.botname, backend.name, digest)
+    return response
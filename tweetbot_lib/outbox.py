@@ -0,0 +1,380 @@
+"""
+Durable outbox for posts, so a post isn't lost when a platform is down.
+
+Publishing appends a post to the outbox table in the state store, one row
+per platform, under a dedupe key (by default the bot, the day and the
+text's hash), so enqueueing the same post twice only sends it once. A
+drain claims due rows in batches, sends them (each bot and platform in
+order, different ones concurrently) and records the outcome of the whole
+batch in one transaction. Failed rows are retried later with backoff.
+
+Delivery is at least once: a claim is a lease, so a post that was sent by a
+process that died before recording it is sent again when the lease expires.
+A sender renews an entry's lease just before sending it, and skips it if
+another drain has taken it over since; the lease is longer than the rate
+limiter waits and request timeouts of one entry's calls add up to, so a
+slow send isn't claimed again while it's still in flight. Mastodon also gets the dedupe key as the post's
+idempotency key.
+An image post keeps the image's path, so the image must still be there when
+the post is retried, or, given the image's bytes, keeps the bytes in the
+outbox_images table until no post waiting to be sent needs them.
+
+    python -m tweetbot_lib.outbox           # drain every minute
+    python -m tweetbot_lib.outbox --once    # drain what's due, then exit
+    python -m tweetbot_lib.outbox --list    # show what's waiting
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import hashlib
+import itertools
+import threading
+import time
+from typing import Iterable, NamedTuple
+
+from tweetbot_lib import backends, media, ratelimit, state, tracing
+
+BATCH_SIZE = 50
+MAX_WORKERS = 8
+# Each API call of a send is tried at most SEND_ATTEMPTS times, waiting at
+# most SEND_MAX_WAIT seconds for the rate limiter before each try and
+# between tries; a post that would wait longer is retried later instead:
+SEND_ATTEMPTS = 2
+SEND_MAX_WAIT = 60
+# An image post is up to four calls (upload, post, and again if a reused
+# upload is rejected), and Bluesky can add a login before a call and a login
+# and a repeat after an expired token; allow for this many per entry:
+SEND_CALLS = 8
+# A call waits for the limiter before each try and between tries, and each
+# try's request can take up to backends.REQUEST_TIMEOUT. An entry's lease
+# has to outlast all of its calls, or another drain would send it again:
+LEASE_SECONDS = SEND_CALLS * (
+    (2 * SEND_ATTEMPTS - 1) * SEND_MAX_WAIT + SEND_ATTEMPTS * backends.REQUEST_TIMEOUT
+)
+MAX_TRIES = 12
+RETRY_BASE = 60
+RETRY_CAP = 6 * 3600
+DRAIN_INTERVAL = 60
+
+
+class Entry(NamedTuple):
+    """One queued post for one platform"""
+
+    id: int
+    dedupe_key: str
+    botname: str
+    platform: str
+    text: str
+    image_fn: str
+    digest: str
+    attempts: int
+    image_data: bytes = None  # the image, if it's kept in the outbox rather than a file
+    leased_until: float = None  # the claim's lease, as next_try
+
+
+def dedupe_key(botname: str, text: str, day: str = None) -> str:
+    """The default dedupe key: one post of 'text' per bot per day"""
+    if day is None:
+        day = datetime.date.today().isoformat()
+    text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+    return f"{botname}/{day}/{text_hash}"
+
+
+@tracing.span("outbox.enqueue")
+def enqueue(
+    botname: str,
+    text: str,
+    platforms: Iterable[str],
+    image_fn: str = None,
+    digest: str = None,
+    key: str = None,
+    path: str = None,
+    image_data: bytes = None,
+) -> list[int]:
+    """
+    Queue a post for each of 'platforms', with the image file image_fn or
+    the image's bytes image_data, if either. Returns the ids of its rows
+    that are still to be sent (none if the post, by dedupe key, was already
+    sent).
+    """
+    if key is None:
+        key = dedupe_key(botname, text)
+    if image_data is not None and digest is None:
+        digest = media.image_hash(image_data)
+    platforms = list(platforms)
+    now = time.time()
+    with state.connect(path) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if image_data is not None:
+            conn.execute(
+                "INSERT OR IGNORE INTO outbox_images (sha256, data) VALUES (?, ?)",
+                (digest, image_data),
+            )
+        conn.executemany(
+            "INSERT OR IGNORE INTO outbox (dedupe_key, botname, platform, text, "
+            "image_fn, digest, enqueued, next_try) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(key, botname, p, text, image_fn, digest, now, now) for p in platforms],
+        )
+        rows = conn.execute(
+            "SELECT id FROM outbox WHERE dedupe_key = ? AND sent IS NULL "
+            f"AND platform IN ({','.join('?' * len(platforms))})",
+            (key, *platforms),
+        ).fetchall()
+        conn.execute("COMMIT")
+    return [row[0] for row in rows]
+
+
+def claim(limit: int = BATCH_SIZE, ids: Iterable[int] = None, path: str = None) -> list[Entry]:
+    """
+    Lease up to 'limit' due rows (only those in 'ids', if given) for sending,
+    oldest first.
+    """
+    now = time.time()
+    leased_until = now + LEASE_SECONDS
+    where = "sent IS NULL AND next_try IS NOT NULL AND next_try <= ?"
+    params = [now]
+    if ids is not None:
+        ids = list(ids)
+        if not ids:
+            return []
+        where += f" AND id IN ({','.join('?' * len(ids))})"
+        params += ids
+
+    with state.connect(path) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, dedupe_key, botname, platform, text, image_fn, digest, attempts, "
+                "data FROM outbox LEFT JOIN outbox_images ON image_fn IS NULL AND digest = sha256 "
+                f"WHERE {where} ORDER BY id LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET next_try = ?, attempts = attempts + 1 WHERE id = ?",
+                [(leased_until, row[0]) for row in rows],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    return [
+        Entry(*row[:-2], attempts=row[-2] + 1, image_data=row[-1], leased_until=leased_until)
+        for row in rows
+    ]
+
+
+def _renew(entry: Entry, path: str = None) -> bool:
+    """
+    Start the entry's lease over, unless its lease has run out and another
+    drain has claimed it since. Returns whether it's still ours to send.
+    """
+    with state.connect(path) as conn:
+        cursor = conn.execute(
+            "UPDATE outbox SET next_try = ? WHERE id = ? AND sent IS NULL AND next_try = ?",
+            (time.time() + LEASE_SECONDS, entry.id, entry.leased_until),
+        )
+    return cursor.rowcount == 1
+
+
+def _send(entry: Entry, path: str = None) -> backends.PublishResult:
+    """
+    Send one entry, reporting (not raising) its error. Returns None if
+    another drain has taken it over.
+    """
+    if not _renew(entry, path):
+        return None
+    backend = backends.BACKENDS[entry.platform](
+        entry.botname, attempts=SEND_ATTEMPTS, max_wait=SEND_MAX_WAIT
+    )
+    image = entry.image_fn or entry.image_data
+    try:
+        if image:
+            value = backend.post_with_image(entry.text, image, entry.digest, entry.dedupe_key)
+        else:
+            value = backend.post(entry.text, entry.dedupe_key)
+    except Exception as err:  # pylint: disable=broad-except
+        print(f"{entry.botname} {entry.platform} error: {err!r}")
+        return backends.PublishResult(entry.platform, False, error=err)
+    return backends.PublishResult(entry.platform, True, value=value)
+
+
+def _remote_id(value: object) -> str:
+    """The platform's id for a post it returned, if it has one"""
+    if isinstance(value, dict):
+        remote_id = value.get("id", value.get("uri"))
+        return None if remote_id is None else str(remote_id)
+    return None
+
+
+def deliver(entries: list[Entry], path: str = None) -> dict:
+    """
+    Send claimed entries, then record how each went. Each bot's posts to a
+    platform go out in order; different bots and platforms go at once.
+    Returns {entry id: PublishResult}, without entries another drain took
+    over.
+    """
+    if not entries:
+        return {}
+
+    def _by_account(entry):
+        return (entry.botname, entry.platform)
+
+    groups = [
+        list(group)
+        for _, group in itertools.groupby(sorted(entries, key=_by_account), key=_by_account)
+    ]
+    def _send_group(group):
+        return [_send(entry, path) for entry in group]
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=min(len(groups), MAX_WORKERS)) as pool:
+        for group, sent in zip(groups, tracing.map(pool, _send_group, groups)):
+            results.update(
+                {entry.id: result for entry, result in zip(group, sent) if result is not None}
+            )
+
+    _record(entries, results, path)
+    return results
+
+
+def _record(entries: list[Entry], results: dict, path: str = None) -> None:
+    """Mark sent entries, and schedule or give up on failed ones, in one transaction"""
+    now = time.time()
+    sent, failed = [], []
+    for entry in entries:
+        result = results.get(entry.id)
+        if result is None:  # another drain is sending it
+            continue
+        if result.ok:
+            sent.append((now, _remote_id(result.value), entry.id))
+            continue
+        next_try = None  # give up
+        if entry.attempts < MAX_TRIES:
+            next_try = now + RETRY_BASE + ratelimit.backoff(
+                entry.attempts - 1, base=RETRY_BASE, cap=RETRY_CAP
+            )
+        failed.append((next_try, repr(result.error), entry.id))
+
+    with state.connect(path) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "UPDATE outbox SET sent = ?, remote_id = ?, last_error = NULL WHERE id = ?", sent
+        )
+        conn.executemany(
+            "UPDATE outbox SET next_try = ?, last_error = ? WHERE id = ?", failed
+        )
+        # Images kept for posts that have all been sent (or given up on):
+        conn.execute(
+            "DELETE FROM outbox_images WHERE sha256 NOT IN (SELECT digest FROM outbox "
+            "WHERE sent IS NULL AND next_try IS NOT NULL AND image_fn IS NULL "
+            "AND digest IS NOT NULL)"
+        )
+        conn.execute("COMMIT")
+
+
+def send_now(ids: list[int], path: str = None) -> dict:
+    """Claim and send the given rows right away, if they are due"""
+    return deliver(claim(len(ids), ids, path), path)
+
+
+def drain(batch_size: int = BATCH_SIZE, path: str = None) -> tuple[int, int]:
+    """Send everything that's due, a batch at a time. Returns (sent, failed)."""
+    sent = failed = 0
+    while entries := claim(batch_size, path=path):
+        results = deliver(entries, path)
+        ok = sum(r.ok for r in results.values())
+        sent, failed = sent + ok, failed + len(results) - ok
+    return sent, failed
+
+
+def run_worker(
+    interval: float = DRAIN_INTERVAL, stop: threading.Event = None, path: str = None
+) -> None:
+    """Drain the outbox every 'interval' seconds until 'stop' is set"""
+    if stop is None:
+        stop = threading.Event()
+    while not stop.is_set():
+        try:
+            with tracing.run("outbox"):
+                sent, failed = drain(path=path)
+            if sent or failed:
+                print(f"{datetime.datetime.now()} outbox: sent {sent}, failed {failed}")
+        except Exception as err:  # pylint: disable=broad-except
+            print(f"{datetime.datetime.now()} outbox error: {err!r}")
+        stop.wait(interval)
+
+
+def start_worker(interval: float = DRAIN_INTERVAL, path: str = None) -> threading.Event:
+    """Drain the outbox in a background thread. Set the returned event to stop it."""
+    stop = threading.Event()
+    threading.Thread(target=run_worker, args=(interval, stop, path), daemon=True).start()
+    return stop
+
+
+def unsent(ids: Iterable[int], path: str = None) -> dict:
+    """
+    Which of the rows 'ids' are still unsent: {platform: next_try}, where
+    next_try is None if the outbox has given up on it
+    """
+    ids = list(ids)
+    if not ids:
+        return {}
+    with state.connect(path) as conn:
+        return dict(
+            conn.execute(
+                "SELECT platform, next_try FROM outbox WHERE sent IS NULL "
+                f"AND id IN ({','.join('?' * len(ids))})",
+                ids,
+            ).fetchall()
+        )
+
+
+def pending(path: str = None) -> list[tuple]:
+    """Unsent rows as (botname, platform, attempts, next_try, last_error, text)"""
+    with state.connect(path) as conn:
+        return conn.execute(
+            "SELECT botname, platform, attempts, next_try, last_error, text FROM outbox "
+            "WHERE sent IS NULL ORDER BY id"
+        ).fetchall()
+
+
+def get_args():
+    """Parse the cli args"""
+    parser = argparse.ArgumentParser(description="Send the bots' queued posts")
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="send what's due now, then exit",
+    )
+    parser.add_argument(
+        "--list",
+        action="store_true",
+        help="list the posts waiting to be sent, then exit",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=DRAIN_INTERVAL,
+        help="seconds between drains",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Drain the outbox once, or forever"""
+    args = get_args()
+    if args.list:
+        for botname, platform, attempts, next_try, last_error, text in pending():
+            when = "gave up" if next_try is None else datetime.datetime.fromtimestamp(next_try)
+            print(f"{botname:25} {platform:9} tries={attempts} next={when} {last_error or ''}")
+            print(f"    {text}")
+    elif args.once:
+        sent, failed = drain()
+        print(f"sent {sent}, failed {failed}")
+    else:
+        run_worker(args.interval)
+
+
+if __name__ == "__main__":
+    main()
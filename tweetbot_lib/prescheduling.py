@@ -0,0 +1,96 @@
+"""
+Pre-schedule the next days of posts for the deterministic text bots.
+
+A text bot's post for any day is fixed by its text file and START_DATE, so
+one run can work out the next N days of chunks and hand them to the server
+as scheduled posts (Mastodon's scheduled_at). The days already scheduled are
+kept in the state store, so re-running only fills in new days. The bots'
+daily runs see the scheduled day in run_recently and do nothing.
+"""
+
+import datetime
+import importlib
+from types import ModuleType
+
+import tweetbot_lib
+from tweetbot_lib import backends, chunk_index, state
+
+DAYS = 7
+
+# Mastodon only accepts scheduled posts at least five minutes out:
+MIN_LEAD = datetime.timedelta(minutes=10)
+
+
+def _post_times(start_date: datetime.datetime, days: int, now: datetime.datetime):
+    """The bot's daily post times (START_DATE's time of day) over the next 'days'"""
+    for offset in range(days + 1):
+        day = now.date() + datetime.timedelta(days=offset)
+        when = datetime.datetime.combine(day, start_date.time())
+        if when >= now + MIN_LEAD:
+            yield when
+
+
+def schedule_text_posts(
+    botname: str,
+    textfile: str,
+    start_date: datetime.datetime,
+    days: int = DAYS,
+    use_lines: bool = False,
+    max_len: int = None,
+    backend: backends.Backend = None,
+) -> dict:
+    """
+    Schedule botname's posts from 'textfile' for the next 'days' days on the
+    server, skipping days that are already scheduled. Returns
+    {day: PublishResult} for the days it tried to schedule.
+    """
+    if backend is None:
+        backend = backends.MastodonBackend(botname)
+
+    now = datetime.datetime.now()
+    post_times = list(_post_times(start_date, days, now))[:days]
+    done = state.scheduled_days(
+        botname, backend.name, (w.date().isoformat() for w in post_times)
+    )
+
+    index = chunk_index.ChunkIndex(tweetbot_lib.get_tweet_filename(textfile), use_lines, max_len)
+    results = {}
+    for when in post_times:
+        day = when.date().isoformat()
+        if day in done:
+            continue
+
+        tweet = index.tweet(tweetbot_lib.get_today_index(len(index), start_date, when), botname)
+        try:
+            response = backend.schedule(tweet.str, when)
+        except Exception as err:  # pylint: disable=broad-except
+            print(f"{botname} {day}: {backend.name} error: {err!r}")
+            results[day] = backends.PublishResult(backend.name, False, error=err)
+            continue
+
+        remote_id = response.get("id") if isinstance(response, dict) else None
+        state.record_scheduled(botname, backend.name, day, when.timestamp(), remote_id)
+        results[day] = backends.PublishResult(backend.name, True, value=response)
+    return results
+
+
+def schedule_bot_module(module: ModuleType, days: int = DAYS) -> dict:
+    """
+    Pre-schedule a text bot module that defines START_DATE and TEXTFILE (and
+    optionally USE_LINES and MAX_LEN).
+    """
+    botname = f"{module.__name__.rsplit('.', 1)[-1]}.py"
+    return schedule_text_posts(
+        botname,
+        module.TEXTFILE,
+        module.START_DATE,
+        days,
+        use_lines=getattr(module, "USE_LINES", False),
+        max_len=getattr(module, "MAX_LEN", None),
+    )
+
+
+def is_text_bot(module_name: str) -> bool:
+    """Can this bot module be pre-scheduled"""
+    module = importlib.import_module(module_name)
+    return hasattr(module, "TEXTFILE") and hasattr(module, "START_DATE")
@@ -0,0 +1,211 @@
+"""
+Shared rate limiter for the publishing backends.
+
+Every (bot, platform, endpoint) gets a token bucket. A call takes a token
+first, waiting only as long as the bucket needs to refill. After each
+response the bucket is reset from the rate-limit headers the platform sent
+back (Twitter's x-rate-limit-*, Mastodon's X-RateLimit-*, Bluesky's
+RateLimit-*, Retry-After), so it tracks what the server allows rather than a
+guess. Failed calls that are worth retrying (rate limited, server errors,
+dropped connections) are retried with exponential backoff and full jitter,
+but never sooner than the server said to.
+"""
+
+import datetime
+import random
+import threading
+import time
+from typing import Callable, Mapping
+
+MAX_ATTEMPTS = 4
+BASE_DELAY = 2.0
+MAX_DELAY = 15 * 60
+
+# (capacity, refill per second) until a response tells us better:
+DEFAULT_LIMIT = (300, 300 / 900)
+LIMITS = {
+    ("twitter", "statuses/update"): (300, 300 / (3 * 3600)),
+    ("twitter", "media/upload"): (500, 500 / (3 * 3600)),
+    ("mastodon", "statuses"): (300, 300 / 300),
+    ("mastodon", "media"): (30, 30 / 1800),
+}
+
+_HEADER_PREFIXES = ("x-rate-limit-", "x-ratelimit-", "ratelimit-")
+
+
+def _header(headers: Mapping, name: str) -> str:
+    """A rate-limit header by its short name ('limit', 'remaining' or 'reset')"""
+    lowered = {k.lower(): v for k, v in headers.items()}
+    for prefix in _HEADER_PREFIXES:
+        if prefix + name in lowered:
+            return lowered[prefix + name]
+    return None
+
+
+def _reset_time(value: str, now: float) -> float:
+    """
+    When a rate-limit window resets, as a time.time() value. Servers send an
+    epoch time, seconds from now, or (Mastodon) an ISO 8601 time.
+    """
+    try:
+        seconds = float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    return seconds if seconds > 1e9 else now + seconds
+
+
+class TokenBucket:
+    """Tokens for one account's endpoint, refilled continuously"""
+
+    def __init__(self, capacity: float, rate: float) -> None:
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+        self.blocked_until = 0.0  # monotonic time before which nothing is allowed
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        if self.blocked_until:
+            if now < self.blocked_until:
+                self.stamp = now
+                return
+            self.blocked_until = 0.0
+            self.tokens = self.capacity
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available"""
+        with self.lock:
+            return self._wait_time(time.monotonic())
+
+    def _wait_time(self, now: float) -> float:
+        self._refill(now)
+        if self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self, sleep: Callable[[float], None] = time.sleep) -> float:
+        """Take a token, sleeping until one is available. Returns the time slept."""
+        slept = 0.0
+        while True:
+            with self.lock:
+                wait = self._wait_time(time.monotonic())
+                if wait <= 0:
+                    self.tokens -= 1
+                    return slept
+            sleep(wait)
+            slept += wait
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available now"""
+        with self.lock:
+            if self._wait_time(time.monotonic()) > 0:
+                return False
+            self.tokens -= 1
+            return True
+
+    def block(self, seconds: float) -> None:
+        """Allow nothing for 'seconds', then start again with a full bucket"""
+        with self.lock:
+            now = time.monotonic()
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.tokens = 0
+            self.stamp = now
+
+    def update(self, headers: Mapping) -> None:
+        """Reset the bucket from a response's rate-limit headers, if it sent any"""
+        if not headers:
+            return
+        retry_after = {k.lower(): v for k, v in headers.items()}.get("retry-after")
+        if retry_after is not None:
+            try:
+                self.block(float(retry_after))
+            except ValueError:
+                pass
+
+        limit, remaining, reset = (_header(headers, n) for n in ("limit", "remaining", "reset"))
+        if remaining is None:
+            return
+        wall_now = time.time()
+        to_reset = _reset_time(reset, wall_now) - wall_now if reset is not None else None
+        with self.lock:
+            now = time.monotonic()
+            if limit is not None:
+                self.capacity = float(limit)
+            self.tokens = min(self.capacity, float(remaining))
+            self.stamp = now
+            if self.tokens >= 1 and retry_after is None:
+                self.blocked_until = 0.0  # the server is taking calls again
+            if to_reset is None or to_reset <= 0:
+                return
+            if self.tokens < 1:
+                self.blocked_until = max(self.blocked_until, now + to_reset)
+            else:
+                # Spread what's left so the bucket is full again at the reset:
+                self.rate = max(self.rate, (self.capacity - self.tokens) / to_reset)
+
+
+_buckets = {}
+_lock = threading.Lock()
+
+
+def bucket(botname: str, platform: str, endpoint: str) -> TokenBucket:
+    """The token bucket for botname's 'endpoint' on 'platform'"""
+    key = (botname, platform, endpoint)
+    with _lock:
+        if key not in _buckets:
+            _buckets[key] = TokenBucket(*LIMITS.get((platform, endpoint), DEFAULT_LIMIT))
+        return _buckets[key]
+
+
+def backoff(attempt: int, base: float = BASE_DELAY, cap: float = MAX_DELAY) -> float:
+    """Exponential backoff with full jitter for the attempt'th retry (from 0)"""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class RateLimitExceeded(Exception):
+    """The next call would have to wait longer than the caller allows"""
+
+
+def call(
+    limiter: TokenBucket,
+    func: Callable[[], object],
+    headers: Callable[[object], Mapping],
+    retryable: Callable[[Exception], bool],
+    attempts: int = MAX_ATTEMPTS,
+    max_wait: float = MAX_DELAY,
+    sleep: Callable[[float], None] = time.sleep,
+) -> object:
+    """
+    Call func() through the limiter, retrying errors that retryable(err) says
+    are worth it. headers(outcome) gives the rate-limit headers of the call
+    just made, from its result or the exception it raised. Rather than wait
+    more than max_wait for the limiter, raise RateLimitExceeded.
+    """
+    attempt = 0
+    while True:
+        wait = limiter.wait_time()
+        if wait > max_wait:
+            raise RateLimitExceeded(f"rate limited for another {wait:.0f}s")
+        limiter.acquire(sleep)
+        try:
+            result = func()
+        except Exception as err:  # pylint: disable=broad-except
+            limiter.update(headers(err))
+            attempt += 1
+            if attempt >= attempts or not retryable(err):
+                raise
+            sleep(min(max_wait, max(limiter.wait_time(), backoff(attempt - 1))))
+            continue
+        limiter.update(headers(result))
+        return result
+
+
+def clear() -> None:
+    """Forget all buckets"""
+    with _lock:
+        _buckets.clear()
@@ -0,0 +1,205 @@
+"""
+Run all the daily bots from one long-lived process.
+
+Each bot module is imported once, by its first run (which times it as its
+"import" span), and the bots share the client and credential caches. Each job runs at its daily time, and jobs that fall
+due together run in parallel in a thread pool. Jobs are rechecked every
+--recheck seconds after their time, like the old hourly cron entries. The
+bots' own run_recently checks make the extra runs no-ops, and each
+claimed run's outcome is recorded in the state store, and its phase
+timings are written out (see tracing.py). The daemon also drains the outbox
+(see outbox.py), resending posts that failed.
+
+Run from the repo root:
+    python -m tweetbot_lib.scheduler            # daemon
+    python -m tweetbot_lib.scheduler --once     # run every job now and exit
+    python -m tweetbot_lib.scheduler --preschedule 7  # queue a week of text posts
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait
+import datetime
+import importlib
+import sys
+import time
+import traceback
+from typing import NamedTuple
+
+import tweetbot_lib
+from tweetbot_lib import outbox, prescheduling, state, tracing
+
+MAX_WORKERS = 8
+RECHECK_SECONDS = 3600
+
+
+class Job(NamedTuple):
+    """A bot to run every day at 'at' (local HH:MM): module.main(*args)"""
+
+    name: str
+    module: str
+    at: str = "05:00"
+    args: tuple = ()
+    botname: str = None  # the botname its run_recently claims, if not the script's
+
+    @property
+    def script(self) -> str:
+        """The bot script's filename, which is its default botname"""
+        return f"{self.module}.py"
+
+    @property
+    def state_botname(self) -> str:
+        """The botname the job's runs are recorded under in the state store"""
+        return self.script if self.botname is None else self.botname
+
+    def next_run(self, after: datetime.datetime) -> datetime.datetime:
+        """The first daily run time strictly after 'after'"""
+        hour, minute = (int(t) for t in self.at.split(":"))
+        run = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if run <= after:
+            run += datetime.timedelta(days=1)
+        return run
+
+    def first_run(self, now: datetime.datetime) -> datetime.datetime:
+        """
+        When a daemon started at 'now' should first run the job: now, if
+        today's time has already passed (run_recently makes that a no-op if
+        it already ran today), else today's time
+        """
+        hour, minute = (int(t) for t in self.at.split(":"))
+        today = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        return now if today <= now else today
+
+
+JOBS = [
+    Job("gettysburg", "twitter_gettysburg"),
+    Job("guthrie", "twitter_guthriebot"),
+    Job("mandolinrain", "twitter_mandolinrainbot"),
+    Job("prince", "twitter_princebot"),
+    Job("second_inaugural", "twitter_second_inaugural"),
+    Job("readtheplaque", "twitter_readtheplaque"),
+    Job("timeghost", "twitter_timeghost"),
+    Job("mercury", "twitter_planetbot", args=("Mercury",), botname="mercurybot"),
+    Job("venus", "twitter_planetbot", args=("Venus",), botname="venusbot"),
+]
+
+
+def run_job(job: Job) -> None:
+    """Run one job, timing it (see tracing.py) and reporting (not raising) its errors"""
+    try:
+        with tracing.run(job.state_botname):
+            module = sys.modules.get(job.module)
+            if module is None:
+                with tracing.span("import"):
+                    module = importlib.import_module(job.module)
+            with tweetbot_lib.bot_context(job.script), state.track_runs():
+                module.main(*job.args)
+    except Exception:  # pylint: disable=broad-except
+        print(f"{datetime.datetime.now()} job {job.name} failed:")
+        traceback.print_exc()
+
+
+def run_once(jobs: list[Job], max_workers: int = MAX_WORKERS) -> None:
+    """Run every job now, in parallel, and wait for them all"""
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        wait([pool.submit(run_job, job) for job in jobs])
+
+
+def run_forever(
+    jobs: list[Job],
+    max_workers: int = MAX_WORKERS,
+    recheck: int = RECHECK_SECONDS,
+) -> None:
+    """
+    Run each job at its daily time (and every 'recheck' seconds after), and
+    drain the outbox in the background
+    """
+    outbox.start_worker()
+    now = datetime.datetime.now()
+    next_runs = {job: job.first_run(now) for job in jobs}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            wake = min(next_runs.values())
+            time.sleep(max(0.0, (wake - datetime.datetime.now()).total_seconds()))
+
+            now = datetime.datetime.now()
+            for job, run in next_runs.items():
+                if run <= now:
+                    pool.submit(run_job, job)
+                    next_run = job.next_run(now)
+                    if recheck:
+                        next_run = min(next_run, now + datetime.timedelta(seconds=recheck))
+                    next_runs[job] = next_run
+
+
+def get_args():
+    """Parse the cli args"""
+    parser = argparse.ArgumentParser(description="Run the daily bots in one process")
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="run every selected job now and exit",
+    )
+    parser.add_argument(
+        "--due",
+        action="store_true",
+        help="list which jobs are due to run, then exit",
+    )
+    parser.add_argument(
+        "--preschedule",
+        type=int,
+        default=0,
+        metavar="DAYS",
+        help="schedule the text bots' next DAYS posts on the server, then exit",
+    )
+    parser.add_argument(
+        "--only",
+        type=str,
+        default=None,
+        help="comma-separated job names to run (default: all)",
+    )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=MAX_WORKERS,
+        help="number of jobs that can run at the same time",
+    )
+    parser.add_argument(
+        "--recheck",
+        type=int,
+        default=RECHECK_SECONDS,
+        help="seconds between rechecks after a job's daily time (0 to disable)",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Load the bot definitions once and run them"""
+    args = get_args()
+    jobs = JOBS
+    if args.only:
+        names = args.only.split(",")
+        jobs = [job for job in JOBS if job.name in names]
+    if args.due:
+        due = set(state.due(job.state_botname for job in jobs))
+        for job in jobs:
+            status = "due" if job.state_botname in due else "ran recently"
+            print(f"{job.name:20} {status}")
+        return
+
+    if args.preschedule:
+        for job in jobs:
+            if prescheduling.is_text_bot(job.module):
+                module = importlib.import_module(job.module)
+                results = prescheduling.schedule_bot_module(module, args.preschedule)
+                print(f"{job.name:20} scheduled {sorted(d for d, r in results.items() if r.ok)}")
+        return
+
+    if args.once:
+        run_once(jobs, args.max_workers)
+    else:
+        run_forever(jobs, args.max_workers, args.recheck)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+Local stand-in for the services the bots talk to: the Twitter, Mastodon and
+Bluesky APIs the backends use, the USGS planetary map server (WMS GetMap),
+readtheplaque.com and timeg.host.
+
+The services' paths don't overlap, so one server stands in for all of them.
+It records every post it receives in 'posts' and counts requests per path
+in 'requests'. A request repeated with the same Idempotency-Key header (as
+Mastodon.py sends for a post with an idempotency key) gets the first one's
+response again, without posting again, like Mastodon. Each request can be delayed by a fixed latency, fail with a
+503 at a given error rate, or run into a rate limit (N requests per window
+per path, answered with rate-limit headers and 429s), which is enough to
+exercise and time the bots offline.
+
+    server = standin.serve(latency=0.2)
+    os.environ["TWEETBOT_STANDIN_URL"] = server.url
+    ...
+    server.shutdown()
+
+or, to leave one running:
+    python -m tweetbot_lib.standin [--port 8765] [--latency 0.2]
+        [--error_rate 0.05] [--rate_limit 300/900]
+"""
+
+import argparse
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import itertools
+import json
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """Routes requests to the stand-in endpoint methods"""
+
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real services
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Keep quiet"""
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length)
+
+    def _fields(self, body: bytes) -> dict:
+        """
+        Query string plus form or JSON fields of a request body (multipart
+        bodies aren't parsed)
+        """
+        fields = {k: v[-1] for k, v in parse_qs(urlparse(self.path).query).items()}
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("application/json"):
+            fields.update(json.loads(body or b"{}"))
+        elif content_type.startswith("application/x-www-form-urlencoded"):
+            fields.update({k: v[-1] for k, v in parse_qs(body.decode("utf-8")).items()})
+        return fields
+
+    def _send(self, status: int, payload: object, headers: dict = None) -> None:
+        """Send a JSON payload, or bytes as a JPEG"""
+        if isinstance(payload, bytes):
+            data, content_type = payload, "image/jpeg"
+        else:
+            data, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method: str) -> None:
+        body = self._body() if method == "POST" else b""
+        path = urlparse(self.path).path
+        server = self.server
+        server.count(method, path)
+        route = server.routes.get((method, path))
+        if route is None:
+            self._send(404, {"error": f"no stand-in for {method} {path}"})
+            return
+
+        time.sleep(server.latency)
+        allowed, headers = server.check_rate_limit(path)
+        if not allowed:
+            self._send(429, {"error": "Too Many Requests"}, headers)
+        elif server.should_fail():
+            self._send(503, {"error": "Service Unavailable"}, headers)
+        else:
+            status, payload = server.idempotent(
+                (path, self.headers.get("Idempotency-Key")),
+                lambda: route(server, self._fields(body), body),
+            )
+            self._send(status, payload, headers)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """GET requests"""
+        self._handle("GET")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """POST requests"""
+        self._handle("POST")
+
+
+def _post(server, platform: str, text: str, media: bool = False) -> int:
+    """Record a post and return its id"""
+    post_id = next(server.ids)
+    with server.lock:
+        server.posts.append(
+            {"platform": platform, "id": post_id, "text": text, "media": media}
+        )
+    return post_id
+
+
+def _mastodon_instance(server, fields, body):  # pylint: disable=unused-argument
+    return 200, {"uri": "standin", "title": "stand-in", "version": "4.0.0"}
+
+
+def _mastodon_media(server, fields, body):  # pylint: disable=unused-argument
+    return 200, {"id": str(next(server.ids)), "type": "image", "url": "standin"}
+
+
+def _mastodon_status(server, fields, body):  # pylint: disable=unused-argument
+    media = bool(fields.get("media_ids") or fields.get("media_ids[]"))
+    post_id = _post(server, "mastodon", fields.get("status"), media)
+    return 200, {"id": str(post_id), "content": fields.get("status")}
+
+
+def _twitter_media(server, fields, body):  # pylint: disable=unused-argument
+    media_id = next(server.ids)
+    return 200, {"media_id": media_id, "media_id_string": str(media_id)}
+
+
+def _twitter_status(server, fields, body):  # pylint: disable=unused-argument
+    post_id = _post(server, "twitter", fields.get("status"), "media_ids" in fields)
+    return 200, {"id": post_id, "id_str": str(post_id), "text": fields.get("status")}
+
+
+def _bluesky_session(server, fields, body):  # pylint: disable=unused-argument
+    handle = fields.get("identifier", "standin")
+    return 200, {
+        "accessJwt": f"access-{next(server.ids)}",
+        "refreshJwt": "refresh",
+        "did": f"did:plc:{handle}",
+        "handle": handle,
+    }
+
+
+def _bluesky_blob(server, fields, body):  # pylint: disable=unused-argument
+    blob = {"$link": f"blob-{next(server.ids)}"}
+    return 200, {"blob": {"$type": "blob", "ref": blob, "mimeType": "image/jpeg", "size": len(body)}}
+
+
+def _bluesky_record(server, fields, body):  # pylint: disable=unused-argument
+    record = fields.get("record", {})
+    post_id = _post(server, "bluesky", record.get("text"), "embed" in record)
+    return 200, {"uri": f"at://{fields.get('repo')}/app.bsky.feed.post/{post_id}", "cid": "standin"}
+
+
+def _usgs_getmap(server, fields, body):  # pylint: disable=unused-argument
+    """A mid-gray noise JPEG of the requested size, like a patch of planet"""
+    if fields.get("REQUEST") != "GetMap":
+        return 400, {"error": "only GetMap is stood in"}
+    return 200, server.map_image(int(fields.get("WIDTH", 256)), int(fields.get("HEIGHT", 256)))
+
+
+def _plaque(server, fields, body):  # pylint: disable=unused-argument
+    """readtheplaque.com's featured/random: the day's plaque tweet"""
+    plaque_id = next(server.ids)
+    return 200, {
+        "tweet": f"Plaque {plaque_id}: stand-in plaque text https://readtheplaque.com/plaque/{plaque_id}",
+        "submitter_tweet": "",
+    }
+
+
+def _empty(server, fields, body):  # pylint: disable=unused-argument
+    return 200, {}
+
+
+def _tweet_text(server, fields, body):  # pylint: disable=unused-argument
+    """timeg.host's (and readtheplaque.com's) /tweet"""
+    return 200, {"tweet": f"Stand-in tweet {next(server.ids)} from the past"}
+
+
+ROUTES = {
+    ("GET", "/api/v1/instance"): _mastodon_instance,
+    ("GET", "/api/v1/instance/"): _mastodon_instance,
+    ("POST", "/api/v1/media"): _mastodon_media,
+    ("POST", "/api/v2/media"): _mastodon_media,
+    ("POST", "/api/v1/statuses"): _mastodon_status,
+    ("POST", "/1.1/media/upload.json"): _twitter_media,
+    ("POST", "/1.1/statuses/update.json"): _twitter_status,
+    ("POST", "/xrpc/com.atproto.server.createSession"): _bluesky_session,
+    ("POST", "/xrpc/com.atproto.repo.uploadBlob"): _bluesky_blob,
+    ("POST", "/xrpc/com.atproto.repo.createRecord"): _bluesky_record,
+    ("GET", "/cgi-bin/mapserv"): _usgs_getmap,
+    ("GET", "/featured/random"): _plaque,
+    ("GET", "/flush"): _empty,
+    ("GET", "/tweet"): _tweet_text,
+}
+
+
+class StandinServer(ThreadingHTTPServer):
+    """The stand-in server, with what it has received"""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit: tuple[int, float] = None,
+    ) -> None:
+        """
+        rate_limit is (requests, window seconds) allowed per path, or None
+        for no limit.
+        """
+        super().__init__(("127.0.0.1", port), StandinHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.routes = dict(ROUTES)
+        self.posts = []
+        self.requests = collections.Counter()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self._windows = {}  # path -> (window start, requests in window)
+        self._responses = {}  # (path, Idempotency-Key) -> (status, payload)
+        self._images = {}
+        self._random = random.Random(0)
+
+    @property
+    def url(self) -> str:
+        """Base URL to give the backends"""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, method: str, path: str) -> None:
+        """Count a request"""
+        with self.lock:
+            self.requests[(method, path)] += 1
+
+    def idempotent(self, key: tuple, respond) -> tuple[int, object]:
+        """
+        respond()'s (status, payload), or, for a repeat of a successful
+        request with the same (path, Idempotency-Key), its response again
+        """
+        if key[1] is None:
+            return respond()
+        with self.lock:
+            response = self._responses.get(key)
+        if response is None:
+            response = respond()
+            if response[0] == 200:
+                with self.lock:
+                    response = self._responses.setdefault(key, response)
+        return response
+
+    def should_fail(self) -> bool:
+        """Should this request fail, at error_rate"""
+        with self.lock:
+            return self._random.random() < self.error_rate
+
+    def check_rate_limit(self, path: str) -> tuple[bool, dict]:
+        """Is a request to 'path' within the rate limit, and its rate-limit headers"""
+        if self.rate_limit is None:
+            return True, {}
+        limit, window = self.rate_limit
+        now = time.time()
+        with self.lock:
+            start, used = self._windows.get(path, (now, 0))
+            if now >= start + window:
+                start, used = now, 0
+            allowed = used < limit
+            if allowed:
+                used += 1
+            self._windows[path] = (start, used)
+        headers = {
+            "X-RateLimit-Limit": limit,
+            "X-RateLimit-Remaining": limit - used,
+            "X-RateLimit-Reset": int(start + window) + 1,
+        }
+        if not allowed:
+            headers["Retry-After"] = int(start + window - now) + 1
+        return allowed, headers
+
+    def map_image(self, width: int, height: int) -> bytes:
+        """A mid-gray noise JPEG, made once per size"""
+        with self.lock:
+            image = self._images.get((width, height))
+        if image is None:
+            from PIL import Image  # pylint: disable=import-outside-toplevel
+
+            out = io.BytesIO()
+            Image.effect_noise((width, height), 32).save(out, "JPEG")
+            image = out.getvalue()
+            with self.lock:
+                self._images[(width, height)] = image
+        return image
+
+
+def serve(
+    port: int = 0,
+    latency: float = 0.0,
+    error_rate: float = 0.0,
+    rate_limit: tuple[int, float] = None,
+) -> StandinServer:
+    """Start a stand-in server in a background thread (port 0: any free port)"""
+    server = StandinServer(port, latency, error_rate, rate_limit)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def parse_rate_limit(value: str) -> tuple[int, float]:
+    """'300/900' -> (300, 900.0): requests per window seconds"""
+    requests, window = value.split("/")
+    return int(requests), float(window)
+
+
+def get_args():
+    """Parse the cli args"""
+    parser = argparse.ArgumentParser(description="Run a stand-in for the bots' services")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds to delay each request"
+    )
+    parser.add_argument(
+        "--error_rate", type=float, default=0.0, help="fraction of requests that get a 503"
+    )
+    parser.add_argument(
+        "--rate_limit",
+        type=parse_rate_limit,
+        default=None,
+        metavar="N/SECONDS",
+        help="allow N requests per path per SECONDS-long window",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Run a stand-in server in the foreground"""
+    args = get_args()
+    server = StandinServer(args.port, args.latency, args.error_rate, args.rate_limit)
+    print(f"stand-in listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
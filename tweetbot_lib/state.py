@@ -0,0 +1,357 @@
+"""
+SQLite run-state store for the bots, replacing the ~/.monitor_<bot>.txt files.
+
+One database (in WAL mode) holds each bot's last claimed run, a history of
+runs with timestamps and outcomes, the days whose posts are already
+scheduled on a server, posts rendered ahead of time and waiting to be
+posted, cached media uploads (see media.py) and the outbox of posts to send
+(see outbox.py). Claiming a run is a single IMMEDIATE
+transaction, so two overlapping runs of a bot can't both decide to post.
+"""
+
+import contextlib
+import contextvars
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, NamedTuple
+
+STATE_DB = os.environ.get(
+    "TWEETBOT_STATE_DB", os.path.expanduser("~/.tweetbot_state.sqlite3")
+)
+LEGACY_MONITOR_FILE = os.path.expanduser("~/.monitor_{botname}.txt")
+
+CLAIMED = "claimed"
+PUBLISHED = "published"
+QUEUED = "queued"  # nothing failed, but some posts are still waiting in the outbox
+FAILED = "failed"
+DONE = "done"
+ERROR = "error"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS last_run (
+    botname TEXT PRIMARY KEY,
+    claimed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    botname TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL,
+    outcome TEXT NOT NULL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_botname ON runs (botname, started);
+CREATE TABLE IF NOT EXISTS scheduled (
+    botname TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    day TEXT NOT NULL,
+    post_at REAL NOT NULL,
+    remote_id TEXT,
+    PRIMARY KEY (botname, platform, day)
+);
+CREATE TABLE IF NOT EXISTS prerendered (
+    id INTEGER PRIMARY KEY,
+    botname TEXT NOT NULL,
+    text TEXT NOT NULL,
+    image BLOB,
+    meta TEXT,
+    rendered REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS prerendered_botname ON prerendered (botname, id);
+CREATE TABLE IF NOT EXISTS media (
+    botname TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    media_ref TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    used_up INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (botname, platform, sha256)
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    dedupe_key TEXT NOT NULL,
+    botname TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    text TEXT NOT NULL,
+    image_fn TEXT,
+    digest TEXT,
+    enqueued REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_try REAL,
+    sent REAL,
+    remote_id TEXT,
+    last_error TEXT,
+    UNIQUE (dedupe_key, platform)
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (next_try) WHERE sent IS NULL;
+CREATE TABLE IF NOT EXISTS outbox_images (
+    sha256 TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+"""
+
+class Prerendered(NamedTuple):
+    """A post rendered ahead of time, waiting for one of the bot's runs to post it"""
+
+    text: str
+    image: bytes
+    meta: dict
+    rendered: float
+
+
+# Run ids claimed inside a track_runs() block, so a caller running a bot can
+# record how the run ended:
+_tracked_runs = contextvars.ContextVar("tracked_runs", default=None)
+
+
+# Databases whose schema this process has already created (and put in WAL
+# mode, which sticks to the file), so connect() only does it once per path:
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+def _initialize(conn: sqlite3.Connection, path: str) -> None:
+    """Create the schema in the database at 'path', once per process"""
+    key = os.path.abspath(path)
+    with _init_lock:
+        if key in _initialized:
+            return
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _initialized.add(key)
+
+
+@contextlib.contextmanager
+def connect(path: str = None):
+    """A connection to the state database, creating the schema if needed"""
+    path = path or STATE_DB
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        _initialize(conn, path)
+        yield conn
+    finally:
+        conn.close()
+
+
+def _legacy_claimed_at(botname: str) -> float:
+    """mtime of the bot's old monitor file, if it has one"""
+    try:
+        return os.stat(LEGACY_MONITOR_FILE.format(botname=botname)).st_mtime
+    except OSError:
+        return None
+
+
+def claim(botname: str, seconds: float = 86400, path: str = None) -> int:
+    """
+    Atomically claim a run for botname if it hasn't claimed one in the last
+    'seconds'. Returns the new run's id, or None if the bot ran recently.
+    """
+    now = time.time()
+    with connect(path) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT claimed_at FROM last_run WHERE botname = ?", (botname,)
+            ).fetchone()
+            claimed_at = row[0] if row else _legacy_claimed_at(botname)
+            if claimed_at is not None and now - claimed_at <= seconds:
+                conn.execute("ROLLBACK")
+                return None
+
+            conn.execute(
+                "INSERT INTO last_run (botname, claimed_at) VALUES (?, ?) "
+                "ON CONFLICT (botname) DO UPDATE SET claimed_at = excluded.claimed_at",
+                (botname, now),
+            )
+            run_id = conn.execute(
+                "INSERT INTO runs (botname, started, outcome) VALUES (?, ?, ?)",
+                (botname, now, CLAIMED),
+            ).lastrowid
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    tracked = _tracked_runs.get()
+    if tracked is not None:
+        tracked.append(run_id)
+    return run_id
+
+
+def finish(run_id: int, outcome: str, detail: str = None, path: str = None) -> None:
+    """Record how a claimed run ended"""
+    with connect(path) as conn:
+        conn.execute(
+            "UPDATE runs SET finished = ?, outcome = ?, detail = ? WHERE id = ?",
+            (time.time(), outcome, detail, run_id),
+        )
+
+
+def finish_latest(botname: str, outcome: str, detail: str = None, path: str = None) -> None:
+    """Record the outcome of botname's most recent still-open run, if any"""
+    with connect(path) as conn:
+        conn.execute(
+            "UPDATE runs SET finished = ?, outcome = ?, detail = ? WHERE id = ("
+            "  SELECT id FROM runs WHERE botname = ? AND outcome = ?"
+            "  ORDER BY started DESC LIMIT 1"
+            ")",
+            (time.time(), outcome, detail, botname, CLAIMED),
+        )
+
+
+@contextlib.contextmanager
+def track_runs(path: str = None):
+    """
+    Track runs claimed inside the block. Any still open at the end are
+    finished as DONE, or as ERROR if the block raised.
+    """
+    run_ids = []
+    token = _tracked_runs.set(run_ids)
+    outcome, detail = DONE, None
+    try:
+        yield run_ids
+    except BaseException as err:
+        outcome, detail = ERROR, repr(err)
+        raise
+    finally:
+        _tracked_runs.reset(token)
+        if run_ids:
+            with connect(path) as conn:
+                conn.execute(
+                    "UPDATE runs SET finished = ?, outcome = ?, detail = ? "
+                    f"WHERE outcome = ? AND id IN ({','.join('?' * len(run_ids))})",
+                    (time.time(), outcome, detail, CLAIMED, *run_ids),
+                )
+
+
+def scheduled_days(botname: str, platform: str, days: Iterable[str], path: str = None) -> set:
+    """Which of 'days' (ISO dates) already have a server-side scheduled post"""
+    days = list(days)
+    if not days:
+        return set()
+    with connect(path) as conn:
+        return {
+            row[0]
+            for row in conn.execute(
+                "SELECT day FROM scheduled WHERE botname = ? AND platform = ? "
+                f"AND day IN ({','.join('?' * len(days))})",
+                (botname, platform, *days),
+            )
+        }
+
+
+def record_scheduled(
+    botname: str, platform: str, day: str, post_at: float, remote_id: str, path: str = None
+) -> None:
+    """Remember that botname's post for 'day' is scheduled on the server"""
+    with connect(path) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO scheduled (botname, platform, day, post_at, remote_id) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (botname, platform, day, post_at, remote_id),
+        )
+
+
+def is_scheduled(botname: str, day: str, path: str = None) -> bool:
+    """Is botname's post for 'day' already scheduled on any platform's server"""
+    with connect(path) as conn:
+        row = conn.execute(
+            "SELECT 1 FROM scheduled WHERE botname = ? AND day = ? LIMIT 1",
+            (botname, day),
+        ).fetchone()
+    return row is not None
+
+
+def add_prerendered(
+    botname: str, text: str, image: bytes = None, meta: dict = None, path: str = None
+) -> None:
+    """Queue a post rendered ahead of time for one of botname's runs to post"""
+    with connect(path) as conn:
+        conn.execute(
+            "INSERT INTO prerendered (botname, text, image, meta, rendered) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (botname, text, image, json.dumps(meta or {}), time.time()),
+        )
+
+
+def pop_prerendered(botname: str, path: str = None) -> Prerendered:
+    """Take botname's oldest prerendered post off its queue, or None if it's empty"""
+    with connect(path) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, text, image, meta, rendered FROM prerendered WHERE botname = ? "
+                "ORDER BY id LIMIT 1",
+                (botname,),
+            ).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM prerendered WHERE id = ?", (row[0],))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    if row is None:
+        return None
+    _, text, image, meta, rendered = row
+    return Prerendered(text, image, json.loads(meta) if meta else {}, rendered)
+
+
+def count_prerendered(botname: str, path: str = None) -> int:
+    """How many prerendered posts botname has waiting"""
+    with connect(path) as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM prerendered WHERE botname = ?", (botname,)
+        ).fetchone()[0]
+
+
+def due(botnames: Iterable[str], seconds: float = 86400, path: str = None) -> list[str]:
+    """
+    Which of botnames run_recently would let run: those that haven't claimed
+    a run in the last 'seconds' (going by the old monitor file for a bot the
+    store doesn't know yet) and whose post for today isn't scheduled on a
+    server. One query each for the claims and the scheduled posts.
+    """
+    botnames = list(botnames)
+    if not botnames:
+        return []
+    placeholders = ",".join("?" * len(botnames))
+    with connect(path) as conn:
+        claimed = dict(
+            conn.execute(
+                f"SELECT botname, claimed_at FROM last_run WHERE botname IN ({placeholders})",
+                botnames,
+            )
+        )
+        scheduled = {
+            row[0]
+            for row in conn.execute(
+                f"SELECT DISTINCT botname FROM scheduled WHERE day = ? "
+                f"AND botname IN ({placeholders})",
+                (datetime.date.today().isoformat(), *botnames),
+            )
+        }
+    now = time.time()
+    due_botnames = []
+    for botname in botnames:
+        if botname in scheduled:
+            continue
+        claimed_at = claimed.get(botname)
+        if claimed_at is None:
+            claimed_at = _legacy_claimed_at(botname)
+        if claimed_at is None or now - claimed_at > seconds:
+            due_botnames.append(botname)
+    return due_botnames
+
+
+def history(botname: str, limit: int = 30, path: str = None) -> list[tuple]:
+    """botname's latest runs as (started, finished, outcome, detail), newest first"""
+    with connect(path) as conn:
+        return conn.execute(
+            "SELECT started, finished, outcome, detail FROM runs WHERE botname = ? "
+            "ORDER BY started DESC LIMIT ?",
+            (botname, limit),
+        ).fetchall()
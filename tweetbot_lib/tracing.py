@@ -0,0 +1,279 @@
+"""
+Per-run timings of the bots' phases, and profiling on demand.
+
+Wrap a phase in span(name), as a context manager or a decorator, and its
+wall time is added to the current run's trace. A run is the block of
+run(botname); the scheduler runs each job in one. Spans outside any run go
+to a trace of the whole process, written when it exits, which is what a bot
+script run from cron gets.
+
+When a run ends, its trace is appended as one JSON line to
+TRACE_DIR/<botname>.jsonl, and TRACE_DIR/tweetbot_<botname>.prom is replaced
+with its timings in the Prometheus text format (for node_exporter's textfile
+collector). TRACE_DIR is ~/.tweetbot_traces, or $TWEETBOT_TRACE_DIR.
+
+Work handed to a thread pool joins the run's trace if it's submitted with
+submit(pool, ...) or map(pool, ...) here, which run it in a copy of the
+submitting thread's context.
+
+Set TWEETBOT_PROFILE to "cprofile", "tracemalloc" or "cprofile,tracemalloc"
+to also write each run's cProfile stats (<botname>-<time>.prof) and its top
+memory allocations (<botname>-<time>.tracemalloc.txt) to TRACE_DIR.
+"""
+
+import atexit
+from concurrent.futures import Executor, Future
+import contextlib
+import contextvars
+import json
+import os
+import re
+import sys
+import threading
+import time
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+TRACE_DIR = os.environ.get("TWEETBOT_TRACE_DIR", os.path.expanduser("~/.tweetbot_traces"))
+PROFILE_ENV = "TWEETBOT_PROFILE"
+TRACEMALLOC_FRAMES = 25
+TRACEMALLOC_TOP = 50
+
+
+class Span(NamedTuple):
+    """One timed phase of a run"""
+
+    name: str
+    start: float  # seconds from the start of the run
+    seconds: float
+    depth: int  # how many spans it ran inside
+    ok: bool  # False if it raised
+
+
+class Trace:
+    """The spans of one run"""
+
+    def __init__(self, botname: str) -> None:
+        self.botname = botname
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, name: str, start: float, seconds: float, depth: int, ok: bool) -> None:
+        """Record a span that began at perf_counter() time 'start'"""
+        with self.lock:
+            self.spans.append(Span(name, start - self.start, seconds, depth, ok))
+
+    def phases(self) -> dict:
+        """{span name: (calls, total seconds)}"""
+        phases = {}
+        with self.lock:
+            for span_ in self.spans:
+                calls, seconds = phases.get(span_.name, (0, 0.0))
+                phases[span_.name] = (calls + 1, seconds + span_.seconds)
+        return phases
+
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_depth = contextvars.ContextVar("span_depth", default=0)
+_process_trace = None
+_process_profilers = None
+_lock = threading.Lock()
+
+
+def current() -> Trace:
+    """The current run's trace, or the process's if there's no run"""
+    trace = _current_trace.get()
+    return _process() if trace is None else trace
+
+
+def _process() -> Trace:
+    """The whole process's trace, started by its first span and written at exit"""
+    global _process_trace, _process_profilers  # pylint: disable=global-statement
+    with _lock:
+        if _process_trace is None:
+            _process_trace = Trace(os.path.basename(sys.argv[0]) or "python")
+            _process_profilers = _start_profiling()
+            atexit.register(_finish_process)
+        return _process_trace
+
+
+def _finish_process() -> None:
+    # The process's run is ok if none of its outermost spans raised:
+    ok = all(s.ok for s in _process_trace.spans if s.depth == 0)
+    _finish(_process_trace, ok, _process_profilers)
+
+
+@contextlib.contextmanager
+def span(name: str):
+    """Time the block (or, as a decorator, each call) as phase 'name' of the current run"""
+    trace = current()
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    start = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        trace.add(name, start, time.perf_counter() - start, depth, ok)
+        _depth.reset(token)
+
+
+def submit(pool: Executor, func: Callable, *args, **kwargs) -> Future:
+    """pool.submit(func, ...), run in a copy of this context so its spans join this run"""
+    return pool.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+# pylint: disable-next=redefined-builtin
+def map(pool: Executor, func: Callable, *iterables: Iterable) -> Iterator:
+    """
+    pool.map(func, ...), each call run in a copy of this context (see
+    submit). The calls are all submitted before this returns.
+    """
+    futures = [submit(pool, func, *args) for args in zip(*iterables)]
+    return (future.result() for future in futures)
+
+
+@contextlib.contextmanager
+def run(botname: str):
+    """Trace the block as one run of 'botname', and write out its timings at the end"""
+    trace = Trace(botname)
+    token = _current_trace.set(trace)
+    profilers = _start_profiling()
+    ok = False
+    try:
+        yield trace
+        ok = True
+    finally:
+        _current_trace.reset(token)
+        _finish(trace, ok, profilers)
+
+
+def _start_profiling() -> dict:
+    """Start the profilers TWEETBOT_PROFILE asks for"""
+    wanted = {p.strip().lower() for p in os.environ.get(PROFILE_ENV, "").split(",")}
+    profilers = {}
+    if "cprofile" in wanted:
+        import cProfile  # pylint: disable=import-outside-toplevel
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            profilers["cprofile"] = profiler
+        except ValueError as err:  # another profiler is already running
+            print(f"not profiling this run: {err}")
+    if "tracemalloc" in wanted:
+        import tracemalloc  # pylint: disable=import-outside-toplevel
+
+        # Only stop tracing at the end if this run started it:
+        profilers["tracemalloc"] = not tracemalloc.is_tracing()
+        if profilers["tracemalloc"]:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+    return profilers
+
+
+def _finish(trace: Trace, ok: bool, profilers: dict) -> None:
+    """Stop the run's profilers and write out its timings (if it timed anything)"""
+    seconds = time.perf_counter() - trace.start
+    if "cprofile" in profilers:
+        profilers["cprofile"].disable()
+    if not trace.spans:
+        _stop_tracemalloc(profilers)
+        return
+    try:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        name = re.sub(r"[^\w.-]", "_", trace.botname)
+        with open(os.path.join(TRACE_DIR, f"{name}.jsonl"), "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(_to_json(trace, seconds, ok)) + "\n")
+        _write_atomically(
+            os.path.join(TRACE_DIR, f"tweetbot_{name}.prom"), _to_prometheus(trace, seconds, ok)
+        )
+
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(trace.started))
+        prefix = os.path.join(TRACE_DIR, f"{name}-{stamp}")
+        if "cprofile" in profilers:
+            profilers["cprofile"].dump_stats(f"{prefix}.prof")
+        if "tracemalloc" in profilers:
+            _write_atomically(f"{prefix}.tracemalloc.txt", _tracemalloc_report())
+    except OSError as err:
+        print(f"couldn't write {trace.botname}'s timings: {err!r}")
+    finally:
+        _stop_tracemalloc(profilers)
+
+
+def _stop_tracemalloc(profilers: dict) -> None:
+    if profilers.get("tracemalloc"):
+        import tracemalloc  # pylint: disable=import-outside-toplevel
+
+        tracemalloc.stop()
+
+
+def _to_json(trace: Trace, seconds: float, ok: bool) -> dict:
+    return {
+        "botname": trace.botname,
+        "started": trace.started,
+        "seconds": seconds,
+        "ok": ok,
+        "phases": {
+            name: {"calls": calls, "seconds": total}
+            for name, (calls, total) in trace.phases().items()
+        },
+        "spans": [s._asdict() for s in trace.spans],
+    }
+
+
+def _label(value: str) -> str:
+    """A Prometheus label value, escaped"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _to_prometheus(trace: Trace, seconds: float, ok: bool) -> str:
+    bot = f'bot="{_label(trace.botname)}"'
+    lines = [
+        "# HELP tweetbot_run_seconds Wall time of the bot's last run.",
+        "# TYPE tweetbot_run_seconds gauge",
+        f"tweetbot_run_seconds{{{bot}}} {seconds:.6f}",
+        "# HELP tweetbot_run_success Whether the bot's last run finished without an error.",
+        "# TYPE tweetbot_run_success gauge",
+        f"tweetbot_run_success{{{bot}}} {int(ok)}",
+        "# HELP tweetbot_run_timestamp_seconds When the bot's last run started.",
+        "# TYPE tweetbot_run_timestamp_seconds gauge",
+        f"tweetbot_run_timestamp_seconds{{{bot}}} {trace.started:.3f}",
+    ]
+    phases = sorted(trace.phases().items())
+    lines += [
+        "# HELP tweetbot_phase_seconds Time the bot's last run spent in each phase.",
+        "# TYPE tweetbot_phase_seconds gauge",
+    ]
+    lines += [
+        f'tweetbot_phase_seconds{{{bot},phase="{_label(name)}"}} {total:.6f}'
+        for name, (_, total) in phases
+    ]
+    lines += [
+        "# HELP tweetbot_phase_calls How many times the bot's last run entered each phase.",
+        "# TYPE tweetbot_phase_calls gauge",
+    ]
+    lines += [
+        f'tweetbot_phase_calls{{{bot},phase="{_label(name)}"}} {calls}'
+        for name, (calls, _) in phases
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def _tracemalloc_report() -> str:
+    import tracemalloc  # pylint: disable=import-outside-toplevel
+
+    current_size, peak = tracemalloc.get_traced_memory()
+    stats = tracemalloc.take_snapshot().statistics("lineno")
+    lines = [f"current {current_size} bytes, peak {peak} bytes", ""]
+    lines += [str(stat) for stat in stats[:TRACEMALLOC_TOP]]
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomically(path: str, text: str) -> None:
+    """Write 'path' so readers never see it half-written"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        fh.write(text)
+    os.replace(tmp_path, path)
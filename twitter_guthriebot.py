@@ -1,15 +1,16 @@
 
 import datetime
-from tweetbot_lib import BotTweet, parse_text_and_get_today_tweet
+from tweetbot_lib import BotTweet, parse_text_and_get_today_posts, publish_posts
 
 START_DATE = datetime.datetime(2016, 10, 17, 5, 0, 0) # 5AM 17-Oct-2016
+TEXTFILE = 'guthrie_lyrics.txt'
 
 def main():
     if BotTweet.run_recently(seconds=86400):
         return
 
-    today_tweet = parse_text_and_get_today_tweet('guthrie_lyrics.txt', START_DATE)
-    today_tweet.publish()
+    today_posts = parse_text_and_get_today_posts(TEXTFILE, START_DATE)
+    publish_posts(today_posts)
 
 if __name__ == '__main__':
     main()
@@ -1,46 +1,134 @@
 """
 Module to make images and descriptions of planets from the USGS planetary map
 server's CGI service.
+
+Posts can be rendered ahead of time with --prerender N, which keeps each
+planet's queue (in the state store) N posts deep. A daily run posts the
+oldest queued post, and only renders one itself if the queue is empty.
 """
+import argparse
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+import io
 from math import acos, cos, pi
+import os
 import random
-import sys
-import urllib
+from typing import NamedTuple
 
-from attrdict import AttrDict
 import numpy as np
-from PIL import Image, ImageOps
-from scipy import optimize
-from tweetbot_lib import BotTweet
+from PIL import Image
+from tweetbot_lib import BotTweet, clients, content_cache, ratelimit, state, tracing
 
 DEBUG = False
 DEFAULT_WIDTH = 1920
 DEFAULT_HEIGHT = 1080
-
-PLANETS = AttrDict(
-    {
-        "Venus": AttrDict(
-            {
-                "name": "venus",
-                "botname": "venusbot",
-                "map": "/maps/venus/venus_simp_cyl.map",
-                "layers": "MAGELLAN",
-                "lat_box_side_degrees": (0.1, 3.0),
-                "km_per_lat_deg": 105.6,
-            }
-        ),
-        "Mercury": AttrDict(
-            {
-                "name": "mercury",
-                "botname": "mercurybot",
-                "map": "/maps/mercury/mercury_simp_cyl.map",
-                "layers": "MESSENGER_Color",
-                "lat_box_side_degrees": (1.0, 20.0),
-                "km_per_lat_deg": 42.58,
-            }
-        ),
-    }
+# Each candidate box is checked for darkness in a thumbnail this size (same
+# aspect ratio) first, and only fetched full size if it passes:
+PROBE_WIDTH = DEFAULT_WIDTH // 20
+PROBE_HEIGHT = DEFAULT_HEIGHT // 20
+# How many candidate boxes to probe at once (1: one at a time):
+CANDIDATES = 4
+# Bigger images are fetched as a mosaic of tiles at most this size, this
+# many at once:
+TILE_WIDTH = DEFAULT_WIDTH
+TILE_HEIGHT = DEFAULT_HEIGHT
+MOSAIC_WORKERS = 6
+USGS_MAPSERV_URL = "https://planetarymaps.usgs.gov/cgi-bin/mapserv"
+# Longest to wait for the map server's rate limit before giving up a fetch:
+FETCH_MAX_WAIT = 5 * 60
+# Map server responses are cached on disk, up to this many bytes:
+WMS_CACHE_DIR = os.environ.get(
+    "TWEETBOT_WMS_CACHE", os.path.expanduser("~/.tweetbot_wms_cache")
 )
+WMS_CACHE_BYTES = 256 * 1024 * 1024
+# Each planet's no-data mask (see NoDataMask), built by --build_masks:
+MASK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "masks")
+MASK_WIDTH = 1440
+MASK_HEIGHT = 720
+# Bins with more than this fraction of the peak's count are fitted as the peak:
+PEAK_FRACTION = 0.2
+# Processes rendering posts at once for --prerender:
+PRERENDER_WORKERS = 4
+# Points in the grid BoundingBox.sample inverts its latitude distribution on:
+SAMPLER_GRID = 4097
+
+
+class Planet(NamedTuple):
+    """A planet's map on the USGS map server, and how to frame it"""
+
+    name: str
+    botname: str
+    map: str
+    layers: str
+    lat_box_side_degrees: tuple
+    km_per_lat_deg: float
+
+
+PLANETS = {
+    "Venus": Planet(
+        name="venus",
+        botname="venusbot",
+        map="/maps/venus/venus_simp_cyl.map",
+        layers="MAGELLAN",
+        lat_box_side_degrees=(0.1, 3.0),
+        km_per_lat_deg=105.6,
+    ),
+    "Mercury": Planet(
+        name="mercury",
+        botname="mercurybot",
+        map="/maps/mercury/mercury_simp_cyl.map",
+        layers="MESSENGER_Color",
+        lat_box_side_degrees=(1.0, 20.0),
+        km_per_lat_deg=42.58,
+    ),
+}
+
+
+class Location(NamedTuple):
+    """A point in latitude/longitude, e.g. a BoundingBox's corner"""
+
+    lat: float
+    lng: float
+
+
+def _sample_corners(lat_box_side, aspect_ratio, count, rng=None):
+    """
+    The lower-left corners (latitudes and longitudes, as arrays) of 'count'
+    random boxes that fit on the map, distributed as if drawn uniformly on
+    the sphere and rejected when out of range, without the rejections.
+
+    A box whose corner is at latitude lat is w(lat) = lat_box_side *
+    aspect_ratio / cos(lat) degrees wide, so it fits if lat < 90 -
+    lat_box_side and its corner's longitude is in [0, 360 - w(lat)). The
+    latitude's density is then proportional to cos(lat) * (360 - w(lat)),
+    i.e. to cos(lat) - k with k = lat_box_side * aspect_ratio / 360, and its
+    CDF to sin(lat) - k * lat, which is inverted numerically on a fine grid.
+    Given the latitude, the longitude is uniform over where the box fits.
+
+    Math source: http://mathworld.wolfram.com/SpherePointPicking.html
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    k = lat_box_side * aspect_ratio / 360.0
+    widest = np.arccos(min(k, 1.0))  # beyond this latitude a box is wider than the map
+    low, high = -widest, min(widest, np.radians(90.0 - lat_box_side))
+    if high <= low:
+        raise ValueError(
+            f"no {lat_box_side} degree high box with aspect ratio {aspect_ratio} fits on the map"
+        )
+
+    grid = np.linspace(low, high, SAMPLER_GRID)
+    cdf = np.sin(grid) - k * grid
+    cdf -= cdf[0]
+    lats = np.interp(rng.random(count) * cdf[-1], cdf, grid)
+
+    lngs = rng.random(count) * (360.0 - 360.0 * k / np.cos(lats))
+    return np.degrees(lats), lngs
 
 
 class BoundingBox:
@@ -52,7 +140,7 @@ class BoundingBox:
         aspect ratio and the latitude (so high-latitude images look right).
         If specified, loc must have .lat and .lng attributes
         """
-        assert loc is None or ("lng" in loc and "lat" in loc)
+        assert loc is None or (hasattr(loc, "lng") and hasattr(loc, "lat"))
 
         self.lat = BoundingBox._rand_lat() if loc is None else loc.lat
         self.lat_end = self.lat + lat_box_side
@@ -85,23 +173,54 @@ class BoundingBox:
         return not self.is_out_of_range
 
     @classmethod
-    def get_rand(cls, lat_box_side, aspect_ratio, km_per_lat_deg, max_tries=100):
+    def get_rand(
+        cls, lat_box_side, aspect_ratio, km_per_lat_deg, max_tries=100, mask=None, max_pct_black=1.0
+    ):
         """
         Get a bounding box that is lat_box_side high and within bounds (all 4
-        corners in the lat range [-90, 90] and the lng range [0, 360]).
-        Bails out after max_tries if the geometry is pathological (gigantic
-        lat_box_side?).
-
-        Math source: http://mathworld.wolfram.com/SpherePointPicking.html
-
+        corners in the lat range [-90, 90] and the lng range [0, 360]) and,
+        given the planet's NoDataMask, not estimated to be more than
+        max_pct_black black (see sample).
         """
-        tries = 0
-        box = BoundingBox(lat_box_side, aspect_ratio, km_per_lat_deg)
-        while box.is_out_of_range and tries < max_tries:
-            box = BoundingBox(lat_box_side, aspect_ratio, km_per_lat_deg)
-            tries += 1
+        return cls.sample(
+            lat_box_side, aspect_ratio, km_per_lat_deg, 1, mask, max_pct_black, max_tries
+        )[0]
 
-        return box
+    @classmethod
+    def sample(
+        cls,
+        lat_box_side,
+        aspect_ratio,
+        km_per_lat_deg,
+        count=1,
+        mask=None,
+        max_pct_black=1.0,
+        max_tries=100,
+        rng=None,
+    ):
+        """
+        Get 'count' random bounding boxes that are lat_box_side high and
+        within bounds, drawn all at once and straight from where such boxes
+        fit (see _sample_corners), so there's nothing to reject. Given the
+        planet's NoDataMask, boxes estimated to be more than max_pct_black
+        black are passed over, from max_tries draws per box; if too few
+        aren't, the least dark of the rest make up the count. Raises
+        ValueError if no box that size fits on the map.
+        """
+        draws = count if mask is None else count * max_tries
+        lats, lngs = _sample_corners(lat_box_side, aspect_ratio, draws, rng)
+        if mask is not None:
+            lng_sides = lat_box_side * aspect_ratio / np.cos(np.radians(lats))
+            black = mask.pct_blacks(lats, lats + lat_box_side, lngs, lngs + lng_sides)
+            dark = np.flatnonzero(black > max_pct_black)
+            order = np.concatenate(
+                [np.flatnonzero(black <= max_pct_black), dark[np.argsort(black[dark])]]
+            )
+            lats, lngs = lats[order[:count]], lngs[order[:count]]
+        return [
+            cls(lat_box_side, aspect_ratio, km_per_lat_deg, loc=Location(lat, lng))
+            for lat, lng in zip(lats.tolist(), lngs.tolist())
+        ]
 
     @property
     def box_height_km(self):
@@ -142,34 +261,40 @@ class BoundingBox:
         return -180.0 + 0.5 * (self.lng + self.lng_end)
 
 
-def _gauss(x, *p):
-    """Define model function to be used to fit to the data"""
-    # pylint: disable=invalid-name
-    A, mu, sigma = p
-    return A * np.exp(-((x - mu) ** 2) / (2.0 * sigma ** 2))
-
-
-def _ignore(hist, offset=10, width=3.0):
+def _peak(hist, offset=10):
     """
-    Generate an ignore range that excludes everything based on a gaussian fit
-    to hist[offset:] (ignore first offset bins). Default ignore range is
-    everything outside +/- 3 std from the center of the gaussian fit.
+    Center and standard deviation of the histogram's main peak, ignoring the
+    first offset bins (black). A Gaussian's log is a parabola, so this fits
+    one, in closed form, to the log of the counts near the peak (weighted by
+    the counts, so the sparse tails don't dominate). If that isn't a peak,
+    it falls back to the counts' mean and standard deviation.
     """
-    # pylint: disable=unused-variable,unbalanced-tuple-unpacking
-
-    # p0 is the initial guess for the fitting coefficients (A, mu, & sigma)
-    p_max = max(hist[offset:])  # value of biggest peak in hist, excluding 0:offset
-    p_ctr = hist.index(p_max)  # the index location of that value
-    p_std = 20.0  # initial guess, ~10% of hist width
-    params_initial = [p_max, p_ctr, p_std]
-
-    # Perform the fit, and get the fit coefficients:
-    xdata = list(range(len(hist)))
-    coeff, var_matrix = optimize.curve_fit(_gauss, xdata, hist, params_initial)
-
-    # Get the left and right edges of +/- 3 std dev from the fit center:
-    data_start = int(coeff[1] - width * coeff[2])
-    data_end = int(coeff[1] + width * coeff[2])
+    counts = np.asarray(hist[offset:], dtype=float)
+    bins = np.arange(offset, offset + len(counts), dtype=float)
+    near = counts > PEAK_FRACTION * counts.max()
+    if np.count_nonzero(near) >= 3:
+        curve, slope, _ = np.polyfit(bins[near], np.log(counts[near]), 2, w=counts[near])
+        if curve < 0:
+            return -slope / (2.0 * curve), np.sqrt(-1.0 / (2.0 * curve))
+    total = counts.sum()
+    if not total:
+        return 0.0, 0.0
+    mean = (bins * counts).sum() / total
+    return mean, np.sqrt((counts * (bins - mean) ** 2).sum() / total)
+
+
+@tracing.span("planet.fit")
+def _contrast_lut(hist, offset=10, width=3.0):
+    """
+    A 256-entry lookup table stretching the histogram's main peak, out to
+    +/- width standard deviations (ignore the first offset bins when finding
+    it), over the full 0-255 range, like ImageOps.autocontrast with
+    everything outside that range ignored.
+    """
+    hist = np.asarray(hist)
+    center, std = _peak(hist, offset)
+    data_start = int(center - width * std)
+    data_end = int(center + width * std)
 
     # If the fit is out of bounds, revert to very conservative values:
     if data_start < 0 or data_start > 255:
@@ -180,11 +305,29 @@ def _ignore(hist, offset=10, width=3.0):
         data_start = 0
         data_end = 255
 
-    ignore = list(range(0, data_start)) + list(range(data_end, 255))
+    counted = hist > 0
+    counted[:data_start] = False
+    counted[data_end:255] = False
+    present = np.flatnonzero(counted)
     if DEBUG:
-        print(ignore)
+        print(data_start, data_end)
+
+    identity = np.arange(256)
+    if len(present) < 2:
+        return identity.astype(np.uint8)
+    low, high = present[0], present[-1]
+    scale = 255.0 / (high - low)
+    return np.clip(identity * scale - low * scale, 0, 255).astype(np.uint8)
 
-    return ignore
+
+def _autocontrast(image):
+    """
+    Stretch a grayscale image's contrast (see _contrast_lut): one histogram
+    pass and one lookup table pass over its pixels
+    """
+    lut = _contrast_lut(image.histogram())
+    with tracing.span("planet.contrast"):
+        return image.point(lut.tolist())
 
 
 def _usgs_url(planet, box, width, height, use_shorter_redirect=False, precise=True):
@@ -198,74 +341,503 @@ def _usgs_url(planet, box, width, height, use_shorter_redirect=False, precise=Tr
     if use_shorter_redirect:
         url = f"https://kesterallen.com/{planet.name}/{box_str}/{width}/{height}"
     else:
-        url = (
-            "https://planetarymaps.usgs.gov/cgi-bin/mapserv?"
-            "SERVICE=WMS&VERSION=1.1.1&SRS=EPSG:4326&STYLES=&REQUEST=GetMap&"
-            "FORMAT=image%2Fjpeg&"
-            f"LAYERS={planet.layers}&"
-            f"BBOX={box_str}&"
-            f"WIDTH={width}&"
-            f"HEIGHT={height}&"
-            f"map={planet.map}"
-        )
+        url = _getmap_url(planet, box_str, width, height)
     return url
 
-def _get_image(lat_box_side, planet, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT):
-    """Get a subimage to check for black pixel amount"""
-    aspect_ratio = float(width) / float(height)
-    box = BoundingBox.get_rand(lat_box_side, aspect_ratio, planet.km_per_lat_deg)
+
+def _getmap_url(planet, bbox, width, height):
+    """The map server's WMS GetMap URL for a 'lng,lat,lng_end,lat_end' bbox"""
+    return (
+        f"{USGS_MAPSERV_URL}?"
+        "SERVICE=WMS&VERSION=1.1.1&SRS=EPSG:4326&STYLES=&REQUEST=GetMap&"
+        "FORMAT=image%2Fjpeg&"
+        f"LAYERS={planet.layers}&"
+        f"BBOX={bbox}&"
+        f"WIDTH={width}&"
+        f"HEIGHT={height}&"
+        f"map={planet.map}"
+    )
+
+
+class NoDataMask:
+    """
+    Where a planet's map has data, on a coarse latitude/longitude grid: a
+    boolean array whose rows run from latitude 90 down to -90 and whose
+    columns run from longitude 0 to 360. It's built once from a low
+    resolution fetch of the whole map, so boxes in the map's no-data (black)
+    regions can be passed over without fetching them.
+    """
+
+    def __init__(self, valid):
+        self.valid = valid
+        # Summed-area table: _sums[r, c] is how many of valid[:r, :c] are valid
+        self._sums = np.zeros((valid.shape[0] + 1, valid.shape[1] + 1), dtype=np.int64)
+        np.cumsum(np.cumsum(valid, axis=0), axis=1, out=self._sums[1:, 1:])
+
+    @staticmethod
+    def path(planet):
+        """Where the planet's mask is saved"""
+        return os.path.join(MASK_DIR, f"{planet.name}.npy")
+
+    @classmethod
+    def build(cls, planet, width=MASK_WIDTH, height=MASK_HEIGHT):
+        """Fetch the whole map at width x height and mask its non-black pixels"""
+        resp = clients.get_session("http").get(
+            _getmap_url(planet, "0,-90,360,90", width, height), timeout=300
+        )
+        resp.raise_for_status()
+        return cls(np.asarray(Image.open(io.BytesIO(resp.content)).convert("L")) > 0)
+
+    def save(self, path):
+        """Save the mask as bits, eight columns to a byte"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.save(path, np.packbits(self.valid, axis=1))
+
+    @classmethod
+    def load(cls, planet):
+        """The planet's saved mask, or None if it hasn't been built"""
+        path = cls.path(planet)
+        if not os.path.exists(path):
+            return None
+        return cls(np.unpackbits(np.load(path), axis=1).astype(bool))
+
+    def pct_black(self, box):
+        """Estimated fraction of the box's map that is black (no data)"""
+        return float(
+            self.pct_blacks(
+                np.array([box.lat]), np.array([box.lat_end]),
+                np.array([box.lng]), np.array([box.lng_end]),
+            )[0]
+        )
+
+    def pct_blacks(self, lats, lat_ends, lngs, lng_ends):
+        """pct_black of many boxes at once, given their edges as arrays"""
+        rows, cols = self.valid.shape
+        row = np.clip(((90.0 - lat_ends) / 180.0 * rows).astype(int), 0, rows - 1)
+        row_end = np.clip(np.ceil((90.0 - lats) / 180.0 * rows).astype(int), row + 1, rows)
+        col = np.clip((lngs / 360.0 * cols).astype(int), 0, cols - 1)
+        col_end = np.clip(np.ceil(lng_ends / 360.0 * cols).astype(int), col + 1, cols)
+        sums = self._sums
+        valid = (
+            sums[row_end, col_end] - sums[row, col_end] - sums[row_end, col] + sums[row, col]
+        )
+        return 1.0 - valid / ((row_end - row) * (col_end - col))
+
+
+def _pct_black(hist):
+    """Fraction of an image's pixels that are black, from its histogram"""
+    return float(hist[0]) / float(sum(hist))
+
+
+def _decode(jpeg, width, height):
+    """
+    Decode a map JPEG (a file or file object) to grayscale. In draft mode the
+    JPEG decoder outputs grayscale itself, skipping the color conversion,
+    and downscales by a power of two if the JPEG is bigger than needed.
+    """
+    image = Image.open(jpeg)
+    image.draft("L", (width, height))
+    return image.convert("L")
+
+
+def _map_headers(outcome):
+    """Rate-limit headers of a map request's (response, body), or of the error it raised"""
+    import requests  # pylint: disable=import-outside-toplevel
+
+    if isinstance(outcome, tuple):
+        outcome = outcome[0]
+    elif isinstance(outcome, requests.HTTPError):
+        outcome = outcome.response
+    return outcome.headers if isinstance(outcome, requests.Response) else None
+
+
+def _map_retryable(err):
+    """Is a map request that raised 'err' worth trying again"""
+    import requests  # pylint: disable=import-outside-toplevel
+
+    if isinstance(err, requests.HTTPError):
+        status = err.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(
+        err, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+    )
+
+
+def _get_map(planet, url):
+    """
+    A map image's bytes, streamed into memory. Requests go through the bot's
+    rate limiter for the map server, and rate-limited or failed ones are
+    retried with backoff, like the publishing backends' calls.
+    """
+
+    def _get():
+        body = io.BytesIO()
+        with clients.get_session("http").get(url, timeout=60, stream=True) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(chunk_size=1 << 16):
+                body.write(chunk)
+        body.seek(0)
+        return resp, body
+
+    _, body = ratelimit.call(
+        ratelimit.bucket(planet.botname, "usgs", "mapserv"),
+        _get,
+        _map_headers,
+        _map_retryable,
+        max_wait=FETCH_MAX_WAIT,
+    )
+    return body
+
+
+def _fetch(planet, box, width, height, decode=True):
+    """
+    The box's map image, in grayscale, and its fraction of black pixels. The
+    map server's response is streamed into memory and decoded from there,
+    and cached on disk with its darkness, so checking a cached image's
+    darkness (decode=False: no image, just the fraction) doesn't even read
+    it.
+    """
+    cache = content_cache.ContentCache(WMS_CACHE_DIR, WMS_CACHE_BYTES, suffix=".jpg")
+    key = f"{planet.name}|{planet.layers}|{box.str_precise}|{width}x{height}"
+    entry = cache.get(key)
+    if entry is not None:
+        image = _decode(entry.path, width, height) if decode else None
+        return image, entry.stats["pct_black"]
+
+    body = _get_map(planet, _usgs_url(planet, box, width, height, precise=True))
+    image = _decode(body, width, height)
+    pct_black = _pct_black(image.histogram())
+    cache.put(key, body.getbuffer(), {"pct_black": pct_black})
+    return (image if decode else None), pct_black
+
+
+class Tile(NamedTuple):
+    """Part of a mosaic: its bbox, and where its pixels go in the whole image"""
+
+    lng: float
+    lat: float
+    lng_end: float
+    lat_end: float
+    x: int
+    y: int
+    width: int
+    height: int
+
+    @property
+    def str_precise(self):
+        """Precise string representation, full precision on lat/lng"""
+        return f"{self.lng},{self.lat},{self.lng_end},{self.lat_end}"
+
+
+def _tiles(box, width, height, tile_width=TILE_WIDTH, tile_height=TILE_HEIGHT):
+    """
+    Split a width x height image of the box into a grid of about equal
+    tiles no bigger than tile_width x tile_height. The map is in
+    latitude/longitude, so a tile's bbox is linear in its pixels.
+    """
+    cols = -(-width // tile_width)
+    rows = -(-height // tile_height)
+    xs = [width * i // cols for i in range(cols + 1)]
+    ys = [height * i // rows for i in range(rows + 1)]
+    lng_per_px = (box.lng_end - box.lng) / width
+    lat_per_px = (box.lat_end - box.lat) / height
+    return [
+        Tile(
+            lng=box.lng + x * lng_per_px,
+            lat=box.lat_end - y_end * lat_per_px,  # rows run from the top (north) down
+            lng_end=box.lng + x_end * lng_per_px,
+            lat_end=box.lat_end - y * lat_per_px,
+            x=x,
+            y=y,
+            width=x_end - x,
+            height=y_end - y,
+        )
+        for y, y_end in zip(ys, ys[1:])
+        for x, x_end in zip(xs, xs[1:])
+    ]
+
+
+def _fetch_mosaic(planet, box, width, height, workers=MOSAIC_WORKERS):
+    """
+    The box's map image, like _fetch, but fetched as tiles (see _tiles),
+    'workers' at a time, each decoded straight into its place in one
+    buffer. The image shares the buffer, so the stitched pixels aren't
+    copied again.
+    """
+    pixels = np.empty((height, width), dtype=np.uint8)
+
+    def _fetch_tile(tile):
+        with tracing.span("planet.tile"):
+            image, pct_black = _fetch(planet, tile, tile.width, tile.height)
+        pixels[tile.y : tile.y + tile.height, tile.x : tile.x + tile.width] = image
+        return pct_black * tile.width * tile.height
+
+    tiles = _tiles(box, width, height)
+    with ThreadPoolExecutor(max_workers=min(len(tiles), workers)) as pool:
+        pct_black = sum(tracing.map(pool, _fetch_tile, tiles)) / (width * height)
+    return Image.fromarray(pixels), pct_black
+
+
+def _get_image(lat_box_side, planet, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, box=None):
+    """
+    Get a subimage (of 'box', or else a random box) and its fraction of
+    black pixels, in one request, or as a mosaic if it's bigger than a tile
+    """
+    if box is None:
+        aspect_ratio = float(width) / float(height)
+        box = BoundingBox.get_rand(lat_box_side, aspect_ratio, planet.km_per_lat_deg)
     url = _usgs_url(planet, box, width, height, precise=False)
-    url_precise = _usgs_url(planet, box, width, height, precise=True)
-    tmp_fn, headers = urllib.request.urlretrieve(url_precise)  # pylint: disable=unused-variable
-    image = Image.open(tmp_fn).convert("L")
-    return (box, url, tmp_fn, image)
+    if width > TILE_WIDTH or height > TILE_HEIGHT:
+        image, pct_black = _fetch_mosaic(planet, box, width, height)
+    else:
+        image, pct_black = _fetch(planet, box, width, height)
+    return (box, url, image, pct_black)
+
 
+_masks = {}  # planet name -> (mask file mtime, NoDataMask)
 
-def random_planet_image(planet, max_pct_black=0.5):
-    """Get a subimage without too many black pixels"""
+
+def _mask(planet):
+    """The planet's NoDataMask, loaded again only if its file changes, or None"""
+    try:
+        mtime = os.stat(NoDataMask.path(planet)).st_mtime_ns
+    except OSError:
+        return None
+    cached = _masks.get(planet.name)
+    if cached is None or cached[0] != mtime:
+        cached = _masks[planet.name] = (mtime, NoDataMask.load(planet))
+    return cached[1]
+
+
+def _probe(box, planet, max_pct_black):
+    """The box if its thumbnail isn't too dark, else None"""
+    with tracing.span("planet.probe"):
+        _, pct_black = _fetch(planet, box, PROBE_WIDTH, PROBE_HEIGHT, decode=False)
+    return box if pct_black <= max_pct_black else None
+
+
+def _first_bright_box(lat_box_side, planet, max_pct_black, candidates, aspect_ratio=None):
+    """
+    Probe 'candidates' random boxes (ones the planet's mask, if built, says
+    aren't too dark), all drawn in one batch, at once and return the first
+    one that isn't too dark, without waiting for the rest (None if they all
+    are). A probe that fails only counts as dark, unless they all fail.
+    The boxes' aspect ratio defaults to the probes'.
+    """
+    if aspect_ratio is None:
+        aspect_ratio = float(PROBE_WIDTH) / float(PROBE_HEIGHT)
+    boxes = BoundingBox.sample(
+        lat_box_side,
+        aspect_ratio,
+        planet.km_per_lat_deg,
+        count=max(candidates, 1),
+        mask=_mask(planet),
+        max_pct_black=max_pct_black,
+    )
+    if len(boxes) == 1:
+        return _probe(boxes[0], planet, max_pct_black)
+
+    pool = ThreadPoolExecutor(max_workers=len(boxes))
+    try:
+        pending = {tracing.submit(pool, _probe, box, planet, max_pct_black) for box in boxes}
+        errors = []
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    errors.append(future.exception())
+                elif future.result() is not None:
+                    return future.result()
+        if len(errors) == len(boxes):
+            raise errors[0]
+        return None
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def random_planet_image(
+    planet,
+    max_pct_black=0.5,
+    candidates=CANDIDATES,
+    width=DEFAULT_WIDTH,
+    height=DEFAULT_HEIGHT,
+):
+    """
+    Get a width x height subimage without too many black pixels, as (box,
+    url, JPEG bytes). Candidate boxes are probed with thumbnails,
+    'candidates' at a time concurrently, so a dark box costs a tiny fetch
+    rather than a full-size one, and a run of dark boxes costs about one
+    round trip rather than one each. An image bigger than a tile is fetched
+    as a mosaic of tiles in parallel and contrast stretched as a whole. The
+    image never touches disk, outside the map server cache.
+    """
 
     lat_box_side = random.uniform(*planet.lat_box_side_degrees)
+    aspect_ratio = float(width) / float(height)
 
     image_too_dark = True
     while image_too_dark:
-        box, url, tmp_fn, image = _get_image(lat_box_side, planet)
-        hist = image.histogram()
+        box = _first_bright_box(lat_box_side, planet, max_pct_black, candidates, aspect_ratio)
+        if box is None:
+            continue
 
-        num_black = hist[0]
-        pct_black = float(num_black) / float(sum(image.histogram()))
+        with tracing.span("planet.fetch"):
+            box, url, image, pct_black = _get_image(lat_box_side, planet, width, height, box)
         image_too_dark = pct_black > max_pct_black
 
-    ignore = _ignore(hist)
-    image = ImageOps.autocontrast(image, ignore=ignore)
-    image_fn = f"{tmp_fn}.jpg"
-    image.save(image_fn)
+    image = _autocontrast(image)
+    jpeg = io.BytesIO()
+    with tracing.span("planet.encode"):
+        image.save(jpeg, "JPEG")
 
     if DEBUG:
         print(box.pretty_str, url)
 
-    return box, url, image_fn
+    return box, url, jpeg.getvalue()
+
+
+def _caption(planet_name, box, url):
+    """The post's text"""
+    return f"{planet_name}, {box.pretty_str}, {url}"
+
 
+def _render(planet_name):
+    """Render a post for the planet: (caption, JPEG bytes, metadata)"""
+    box, url, jpeg = random_planet_image(PLANETS[planet_name])
+    meta = {"planet": PLANETS[planet_name].name, "bbox": box.str_precise, "url": url}
+    return _caption(planet_name, box, url), jpeg, meta
 
-def main():
+
+def prerender(count, planet_names=None, workers=PRERENDER_WORKERS):
+    """
+    Top up each planet's queue of prerendered posts to 'count' posts,
+    rendering them in a pool of 'workers' processes, so slow fetches overlap
+    and the CPU-bound contrast stretching and encoding run in parallel.
+    Returns {planet name: posts added}.
+    """
+    if planet_names is None:
+        planet_names = sorted(PLANETS)
+    wanted = {
+        name: count - state.count_prerendered(PLANETS[name].botname) for name in planet_names
+    }
+    added = dict.fromkeys(planet_names, 0)
+    if not any(n > 0 for n in wanted.values()):
+        return added
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_render, name): name for name, n in wanted.items() for _ in range(n)
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                text, jpeg, meta = future.result()
+            except Exception as err:  # pylint: disable=broad-except
+                print(f"{name}: couldn't prerender a post: {err!r}")
+                continue
+            state.add_prerendered(PLANETS[name].botname, text, jpeg, meta)
+            added[name] += 1
+    return added
+
+
+def build_masks():
+    """Build and save every planet's NoDataMask"""
+    for planet in PLANETS.values():
+        mask = NoDataMask.build(planet)
+        mask.save(NoDataMask.path(planet))
+        print(f"{planet.name}: {1.0 - mask.valid.mean():.1%} no data, {NoDataMask.path(planet)}")
+
+
+def _size(text):
+    """Parse a WIDTHxHEIGHT argument"""
+    try:
+        width, height = (int(n) for n in text.lower().split("x"))
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, e.g. 7680x4320: {text}") from err
+    return width, height
+
+
+def get_args():
+    """Parse the cli args"""
+    parser = argparse.ArgumentParser(description="Post a picture of a planet")
+    parser.add_argument("planet", nargs="?", choices=sorted(PLANETS), help="the planet to post")
+    parser.add_argument(
+        "--build_masks",
+        action="store_true",
+        help="fetch every planet's whole map and save where it has no data, then exit",
+    )
+    parser.add_argument(
+        "--prerender",
+        type=int,
+        default=0,
+        metavar="COUNT",
+        help="render posts ahead until every planet (or just 'planet') has COUNT queued, then exit",
+    )
+    parser.add_argument(
+        "--mosaic",
+        type=_size,
+        default=None,
+        metavar="WIDTHxHEIGHT",
+        help="save one image of 'planet' this big (fetched as tiles) to --output, then exit",
+    )
+    parser.add_argument("--output", help="where --mosaic saves its image")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=PRERENDER_WORKERS,
+        help="processes to prerender with",
+    )
+    args = parser.parse_args()
+    if args.planet is None and (args.mosaic or not (args.build_masks or args.prerender)):
+        parser.error("a planet is required")
+    return args
+
+
+def main(planet_name=None):
     """
-    Generate and publish a planet image
+    Publish a planet image: the planet's oldest prerendered post, or else
+    one generated now. The planet defaults to the first command line
+    argument.
     """
-    planet_name = sys.argv[1]
+    if planet_name is None:
+        args = get_args()
+        if args.build_masks:
+            build_masks()
+            return
+        if args.mosaic:
+            width, height = args.mosaic
+            planet = PLANETS[args.planet]
+            box, url, jpeg = random_planet_image(planet, width=width, height=height)
+            output = args.output or f"{planet.name}_{width}x{height}.jpg"
+            with open(output, "wb") as image_file:
+                image_file.write(jpeg)
+            print(f"{output}: {box.pretty_str}, {url}")
+            return
+        if args.prerender:
+            planet_names = None if args.planet is None else [args.planet]
+            for name, added in prerender(args.prerender, planet_names, args.workers).items():
+                print(f"{name}: {added} posts prerendered")
+            return
+        planet_name = args.planet
     assert planet_name in PLANETS
     planet = PLANETS[planet_name]
 
     if BotTweet.run_recently(seconds=86400, botname=planet.botname):
         return
 
-    box, url, image_fn = random_planet_image(planet)
+    prerendered = state.pop_prerendered(planet.botname)
+    if prerendered is None:
+        box, url, jpeg = random_planet_image(planet)
+        tweet_text = _caption(planet_name, box, url)
+    else:
+        tweet_text, jpeg = prerendered.text, prerendered.image
     if DEBUG:
-        print(box.pretty_str, url)
+        print(tweet_text)
 
-    tweet_text = f"{planet_name}, {box.pretty_str}, {url}"
     twitter = BotTweet(word=tweet_text, botname=planet.botname)
 
     if not DEBUG:
-        twitter.publish_with_image(image_fn)
+        twitter.publish_with_image(image_data=jpeg)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,6 @@
 """ Set the featured plaque for the day and tweet about it """
 
-import requests
-from tweetbot_lib import BotTweet
+from tweetbot_lib import BotTweet, clients
 
 PREFIX = "https://readtheplaque.com/"
 SUFFIXES = {
@@ -22,8 +21,9 @@ def main():
     if BotTweet.run_recently(seconds=86400):
         return
 
-    resp = requests.get(URLS["RAND"])
-    requests.get(URLS["FLUSH"])
+    session = clients.get_session("http")
+    resp = session.get(URLS["RAND"], timeout=60)
+    session.get(URLS["FLUSH"], timeout=60)
     resp_json = resp.json()
 
     twitter = BotTweet(resp_json["tweet"])
@@ -7,14 +7,16 @@ import socket
 import time
 
 import requests
-from twython import TwythonStreamer, Twython
+from twython import TwythonStreamer
 from twython.exceptions import TwythonError
-from tweetbot_lib import BotTweet
+from tweetbot_lib import BotTweet, backends, ratelimit
 
 
 SLEEP_ERROR = 90
 SLEEP_TWEET = 2700
-SLEEP_DUPLICATE = 10
+# Replies are tried once, waiting at most this long for the rate limiter, so
+# a rate limit skips a match rather than stalling the stream:
+REPLY_MAX_WAIT = 5
 
 DEFAULT_TRACKS = [ # harpo's
     "harpo marx",
@@ -44,11 +46,6 @@ DEFAULT_REPLIES = [ # harpo's
     '*whistles*',
 ]
 
-class ReplierSleep(Exception):
-    """
-    Exception to cause a sleep in the main method, instead of the on_success
-    """
-
 def now():
     """Convenience function to get current time in right format."""
     return datetime.datetime.now().strftime('%Y-%m-%d %H:%M')
@@ -56,15 +53,19 @@ def now():
 
 class ReplierStreamer(TwythonStreamer):
     """Replier streamer class."""
-    def __init__(self, keys, args):
+    def __init__(self, keys, args, reply_bucket):
         super().__init__(*keys)
         self.keys = keys
         self.track = args.track
         self.replies = args.replies.split(',')
         self.sendtweet = args.sendtweet
-        self.sleep_error = args.sleep_error
-        self.sleep_tweet = args.sleep_tweet
-        self.sleep_duplicate = args.sleep_duplicate
+        self.twitter = backends.TwitterBackend(
+            args.botname, attempts=1, max_wait=REPLY_MAX_WAIT
+        )
+        # One reply per sleep_tweet seconds; matches in between are skipped,
+        # rather than dropping the stream to sleep:
+        self.reply_bucket = reply_bucket
+        self.received = False
 
     def _get_reply(self, data):
         """Extract tweet ID, author, and the reply to it."""
@@ -77,37 +78,41 @@ class ReplierStreamer(TwythonStreamer):
 
     def on_success(self, data):
         """Response to successful scan."""
+        self.received = True
         if 'text' in data:
             st_id, url, reply = self._get_reply(data)
+            if not self.reply_bucket.try_acquire():
+                print(f"{now()} too soon to reply to {url}")
+                return
             print(f"{now()} {reply} {url}")
-            twy = Twython(*self.keys)
             try:
-                if self.sendtweet:
-                    twy.update_status(status=reply, in_reply_to_status_id=st_id)
-                else:
-                    print(f"Debug: supressing tweet '{reply}'")
-            except TwythonError:
-                # Twitter rejects duplicate replies, get a non-duplicate one:
-                old_reply = reply
-                while old_reply == reply:
-                    _, _, reply = self._get_reply(data)
-                time.sleep(SLEEP_DUPLICATE)
-                if self.sendtweet:
-                    twy.update_status(status=reply, in_reply_to_status_id=st_id)
-                else:
-                    print(f"Debug: skip duplicate tweet '{reply}'")
-            raise ReplierSleep()
+                try:
+                    if self.sendtweet:
+                        self.twitter.reply(reply, st_id)
+                    else:
+                        print(f"Debug: supressing tweet '{reply}'")
+                except TwythonError:
+                    # Twitter rejects duplicate replies, get a non-duplicate one
+                    # (the rate limiter paces the second try):
+                    old_reply = reply
+                    while old_reply == reply:
+                        _, _, reply = self._get_reply(data)
+                    if self.sendtweet:
+                        self.twitter.reply(reply, st_id)
+                    else:
+                        print(f"Debug: skip duplicate tweet '{reply}'")
+            except ratelimit.RateLimitExceeded as err:
+                print(f"{now()} rate limited, not replying to {url}: {err}")
 
     def on_error(self, status_code, data, headers=None):
-        """Response to failed scan."""
+        """Response to failed scan. main() backs off before reconnecting."""
         print(f"{now()} in on_error: {status_code} {data}")
-        time.sleep(SLEEP_ERROR)
         self.disconnect()
 
     def on_timeout(self):
-        """Response to timeout scan."""
+        """Response to timeout scan. main() backs off before reconnecting."""
         print(f"{now()} in on_timeout")
-        time.sleep(SLEEP_ERROR)
+        self.disconnect()
 
 def get_args():
     """Parse the cli args"""
@@ -138,38 +143,47 @@ def get_args():
         '--sleep_error',
         type=int,
         default=SLEEP_ERROR,
-        help='Number of seconds to sleep after an error',)
+        help='Base number of seconds to back off after an error (doubles per error)',)
     parser.add_argument(
         '--sleep_tweet',
         type=int,
         default=SLEEP_TWEET,
-        help='Number of seconds to sleep after a successful tweet',)
+        help='Minimum number of seconds between replies',)
+    # Deprecated: duplicates are skipped right away now. Still accepted so
+    # existing cron lines keep working.
     parser.add_argument(
         '--sleep_duplicate',
         type=int,
-        default=SLEEP_DUPLICATE,
-        help='Number of seconds to sleep after attempting a duplicate tweet',)
+        default=None,
+        help=argparse.SUPPRESS,)
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.sleep_duplicate is not None:
+        print(f"{now()} warning: --sleep_duplicate is deprecated and ignored")
+    return args
 
 def main():
     """Run Streamer"""
     args = get_args()
     keys = BotTweet(botname=args.botname).twitter_keys
+    reply_bucket = ratelimit.TokenBucket(1, 1 / args.sleep_tweet)
 
+    errors = 0
     while True:
+        streamer = ReplierStreamer(keys, args, reply_bucket)
         try:
-            streamer = ReplierStreamer(keys, args)
             streamer.statuses.filter(track=streamer.track)
         except (
                 requests.exceptions.ConnectionError,
                 requests.exceptions.ChunkedEncodingError,
                 socket.error,
                 TwythonError,
+                ratelimit.RateLimitExceeded,
         ):
-            time.sleep(SLEEP_ERROR)
-        except ReplierSleep:
-            time.sleep(SLEEP_TWEET)
+            pass
+        # The stream only ends on errors; back off more for each one in a row
+        errors = 0 if streamer.received else errors + 1
+        time.sleep(ratelimit.backoff(errors, base=args.sleep_error))
 
 if __name__ == '__main__':
     main()
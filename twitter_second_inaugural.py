@@ -3,13 +3,14 @@ import datetime
 import tweetbot_lib
 
 START_DATE = datetime.datetime(2019, 4, 19, 5, 0, 0) # 5AM 18-April-2019
+TEXTFILE = 'second_inaugural.txt'
+USE_LINES = True
 
 def main():
     if tweetbot_lib.BotTweet.run_recently(seconds=86400):
         return
-    tweetbot_lib.MAX_TWEET_LEN = 280
-    today_tweet = tweetbot_lib.parse_text_and_get_today_tweet('second_inaugural.txt', START_DATE, use_lines=True)
-    today_tweet.publish()
+    today_posts = tweetbot_lib.parse_text_and_get_today_posts(TEXTFILE, START_DATE, use_lines=USE_LINES)
+    tweetbot_lib.publish_posts(today_posts)
 
 if __name__ == '__main__':
     main()
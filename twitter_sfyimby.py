@@ -6,11 +6,18 @@ import requests
 import socket
 import sys
 import time
-from twython import TwythonStreamer, Twython
+from twython import TwythonStreamer
 from twython.exceptions import TwythonError
-from tweetbot_lib import BotTweet
+from tweetbot_lib import BotTweet, backends, ratelimit
 
-keys = BotTweet().twitter_keys
+bot = BotTweet()
+keys = bot.twitter_keys
+# Try each reply once, and skip it rather than stall the stream if the rate
+# limiter would make it wait:
+twitter = backends.TwitterBackend(bot.botname, attempts=1, max_wait=5)
+
+# At most one reply every 45 minutes; matches in between are skipped
+reply_bucket = ratelimit.TokenBucket(1, 1 / 2700)
 
 track_phrases = [
     "San Francisco housing crisis",
@@ -22,10 +29,6 @@ replies = [
     # Add more here
 ]
 
-class YimbySleep(Exception):
-    """Throw one of these to sleep in the main method, instead of the on_success"""
-    pass
-
 def current_time():
     return datetime.datetime.now().strftime('%Y-%m-%d %H:%M')
 
@@ -34,31 +37,35 @@ def get_reply(data):
     return reply
 
 class YimbyStreamer(TwythonStreamer):
+    received = False
+
     def on_success(self, data):
+        self.received = True
         if 'text' in data:
+            if not reply_bucket.try_acquire():
+                return
             reply = get_reply(data)
             print(current_time(), reply,
                 "https://twitter.com/{0}/status/{1}".format(data['user']['screen_name'], data['id']))
-            twitter = Twython(*keys)
             try:
-                twitter.update_status(status=reply, in_reply_to_status_id=data['id'])
-            except TwythonError:
-                # Get a non-duplicate reply
-                old_reply = reply
-                while old_reply == reply:
-                    reply = get_reply(data)
-                time.sleep(10)
-                twitter.update_status(status=reply, in_reply_to_status_id=data['id'])
-            raise YimbySleep()
+                try:
+                    twitter.reply(reply, data['id'])
+                except TwythonError:
+                    # Get a non-duplicate reply
+                    old_reply = reply
+                    while old_reply == reply:
+                        reply = get_reply(data)
+                    twitter.reply(reply, data['id'])
+            except ratelimit.RateLimitExceeded as err:
+                print(current_time(), "rate limited, skipping:", err)
 
     def on_error(self, status_code, data):
         print(current_time(), "in on_error", status_code, "on_error", data)
-        time.sleep(1)
         self.disconnect()
 
     def on_timeout(self, status_code, data):
         print(current_time(), status_code, "on_timeout", data)
-        time.sleep(1)
+        self.disconnect()
 
 def main():
     if len(sys.argv) > 1:
@@ -66,20 +73,21 @@ def main():
 
     track = ",".join(track_phrases)
 
+    errors = 0
     while True:
+        streamer = YimbyStreamer(*keys)
         try:
-            streamer = YimbyStreamer(*keys)
             streamer.statuses.filter(track=track)
         except (
             requests.exceptions.ConnectionError,
             requests.exceptions.ChunkedEncodingError,
             socket.error,
             TwythonError,
+            ratelimit.RateLimitExceeded,
         ) as err:
             print(current_time(), "restarting ", err)
-            time.sleep(60)
-        except YimbySleep as ys_err:
-            time.sleep(2700)
+        errors = 0 if streamer.received else errors + 1
+        time.sleep(ratelimit.backoff(errors, base=60))
     
 if __name__ == '__main__':
     main()